@@ -0,0 +1,191 @@
+""" Benchmarks for the document pipeline. Run with `python benchmark.py <name> [options]` """
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple
+
+import fitz
+from PIL import Image
+
+import pdf_viewer
+
+
+def make_sample_pdf(path: Path, pages: int = 1, lines: int = 60) -> Path:
+    """ Write a text heavy PDF to use when no real document is given """
+    with fitz.open() as pdf:
+        for p in range(pages):
+            page = pdf.new_page(width=595, height=842)
+            text = '\n'.join(f'{p:03d}-{i:03d} Lorem ipsum dolor sit amet, PO 4500{i:06d} ETA 2026-10-{i % 28 + 1:02d}' for i in range(lines))
+            page.insert_text((40, 50), text, fontsize=9)
+        pdf.save(path)
+    return path
+
+def timed(func: Callable[[], Tuple[object, int]], repeat: int) -> Tuple[float, int]:
+    """ Median milliseconds of `repeat` calls, and the bytes reported by the last call """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _, nbytes = func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), nbytes
+
+def report(title: str, header: Iterable[str], rows: List[Iterable[object]]) -> None:
+    print(title)
+    print('  ' + ' | '.join(f'{h:>14}' for h in header))
+    for row in rows:
+        print('  ' + ' | '.join(f'{v:>14.2f}' if isinstance(v, float) else f'{v!s:>14}' for v in row))
+    print()
+
+
+def render_resize(pdf: fitz.Document, page: int, width: int) -> Tuple[Image.Image, int]:
+    """ Previous display path: 72 dpi render resized with LANCZOS """
+    pix = pdf.get_page_pixmap(page)
+    img = Image.frombytes('RGB', [pix.width, pix.height], pix.samples)
+    resized = img.resize((width, int(img.height * width / img.width)), Image.LANCZOS)
+    return resized, len(pix.samples) + 3 * img.width * img.height + 3 * resized.width * resized.height
+
+def render_direct(pdf: fitz.Document, page: int, width: int) -> Tuple[object, int]:
+    """ Current display path: MuPDF renders straight to the displayed size as PPM data """
+    bitmap = pdf_viewer.render_bitmap(pdf, page, width)
+    return bitmap, 3 * bitmap.width * bitmap.height + bitmap.nbytes
+
+def bench_render(pdf_file: Path, widths: Iterable[int], repeat: int) -> None:
+    """ Compare latency and pixel memory of resizing a 72 dpi render and direct rendering """
+    rows = []
+    with fitz.open(pdf_file) as pdf:
+        for width in widths:
+            old_ms, old_bytes = timed(lambda: render_resize(pdf, 0, width), repeat)
+            new_ms, new_bytes = timed(lambda: render_direct(pdf, 0, width), repeat)
+            rows.append((width, old_ms, new_ms, old_bytes // 1024, new_bytes // 1024))
+
+    report(f'Render first page of {pdf_file.name} (median of {repeat})',
+           ('width px', 'resize ms', 'direct ms', 'resize KiB', 'direct KiB'), rows)
+
+
+# Pane sizes the conversion is measured at, the page is fitted to the pane width
+PANE_SIZES = {'1080p': (1920, 1080), '4K': (3840, 2160)}
+
+def convert_pil(pix: fitz.Pixmap, master) -> Tuple[object, int]:
+    """ Previous path: samples -> PIL image -> ImageTk.PhotoImage """
+    from PIL import ImageTk
+
+    samples = pix.samples
+    img = Image.frombytes('RGB', [pix.width, pix.height], samples)
+    photo = ImageTk.PhotoImage(img, master=master) if master is not None else None
+    # Tk photo blocks are stored with 4 bytes per pixel
+    return photo, len(samples) + 3 * img.width * img.height + (4 * img.width * img.height if photo else 0)
+
+def convert_ppm(pix: fitz.Pixmap, master) -> Tuple[object, int]:
+    """ Current path: MuPDF writes PPM which Tk decodes itself """
+    from render_cache import PageBitmap
+
+    bitmap = PageBitmap(pix.width, pix.height, pix.tobytes('ppm'))
+    photo = bitmap.photo(master) if master is not None else None
+    return photo, bitmap.nbytes + (4 * pix.width * pix.height if photo else 0)
+
+def bench_convert(pdf_file: Path, repeat: int) -> None:
+    """ Compare the bytes copied and time spent going from a pixmap to a Tk photo image """
+    import tkinter as tk
+
+    try:
+        master = tk.Tk()
+        master.withdraw()
+    except tk.TclError:
+        print('No display available, Tk photo creation is left out\n')
+        master = None
+
+    rows = []
+    with fitz.open(pdf_file) as pdf:
+        page = pdf[0]
+        for name, (width, _) in PANE_SIZES.items():
+            zoom = width / page.rect.width
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            pil_ms, pil_bytes = timed(lambda: convert_pil(pix, master), repeat)
+            ppm_ms, ppm_bytes = timed(lambda: convert_ppm(pix, master), repeat)
+            rows.append((f'{name} {pix.width}x{pix.height}', pil_ms, ppm_ms, pil_bytes // 1024, ppm_bytes // 1024))
+
+    if master is not None:
+        master.destroy()
+
+    report(f'Pixmap to PhotoImage for {pdf_file.name} (median of {repeat})',
+           ('pane', 'PIL ms', 'PPM ms', 'PIL KiB copied', 'PPM KiB copied'), rows)
+
+
+def make_corpus(folder: Path, docs: int) -> List[Path]:
+    """ Write PDFs with a header like the ones extract_info reads, followed by a body """
+    paths = []
+    for i in range(docs):
+        header = (f'PICKLIST {"(NEW)" if i % 2 else "(UPDATED)"} DATE 2026-10-{i % 28 + 1:02d} TIME 8:{i % 60:02d}:00 '
+                  f'SYSPED {i:06d} REF {i:04d} TR {1000 + i} PO 4500{i:06d} ETD 2026-10-01 ETA 2026-10-15')
+        body = '\n'.join(f'{n:03d} Lorem ipsum dolor sit amet, consectetur adipiscing elit' for n in range(80))
+        with fitz.open() as pdf:
+            page = pdf.new_page(width=595, height=842)
+            page.insert_text((40, 30), header, fontsize=8)
+            page.insert_text((40, 80), body, fontsize=9)
+            pdf.save(folder / f'doc{i:05d}.pdf')
+        paths.append(folder / f'doc{i:05d}.pdf')
+    return paths
+
+def bench_extract(folder: Path, docs: int) -> None:
+    """ Compare documents per second for the PyPDF2 and PyMuPDF extraction backends """
+    import pdf_reader
+
+    paths = make_corpus(folder, docs)
+    backends = [pdf_reader.PyMuPDFBackend()]
+    if pdf_reader.PdfFileReader is not None:
+        backends.insert(0, pdf_reader.PyPDF2Backend())
+    else:
+        print('PyPDF2 is not installed, only PyMuPDF is measured\n')
+
+    rows = []
+    infos = []
+    for backend in backends:
+        start = time.perf_counter()
+        results = [pdf_reader.safe_extract_info(str(p), backend) for p in paths]
+        elapsed = time.perf_counter() - start
+        failed = sum(r.info is None for r in results)
+        infos.append([r.info for r in results])
+        rows.append((backend.name, elapsed * 1000, docs / elapsed, failed))
+
+    report(f'extract_info over {docs} synthetic documents',
+           ('backend', 'total ms', 'docs/s', 'failed'), rows)
+
+    if len(infos) > 1:
+        same = sum(a == b for a, b in zip(*infos))
+        print(f'Backends agree on {same}/{docs} documents')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    render = sub.add_parser('render', help='Page rendering latency and memory')
+    render.add_argument('pdf', nargs='?', type=Path, help='PDF to render, a sample is generated if omitted')
+    render.add_argument('--widths', type=int, nargs='+', default=[600, 1000, 1600, 2400])
+    render.add_argument('--repeat', type=int, default=10)
+
+    convert = sub.add_parser('convert', help='Pixmap to Tk photo image conversion')
+    convert.add_argument('pdf', nargs='?', type=Path, help='PDF to render, a sample is generated if omitted')
+    convert.add_argument('--repeat', type=int, default=10)
+
+    extract = sub.add_parser('extract', help='Header extraction backends')
+    extract.add_argument('--docs', type=int, default=200)
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.benchmark == 'extract':
+            bench_extract(Path(tmp), args.docs)
+            return
+
+        pdf_file = args.pdf or make_sample_pdf(Path(tmp) / 'sample.pdf')
+
+        if args.benchmark == 'render':
+            bench_render(pdf_file, args.widths, args.repeat)
+        elif args.benchmark == 'convert':
+            bench_convert(pdf_file, args.repeat)
+
+if __name__ == '__main__':
+    main()
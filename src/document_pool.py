@@ -0,0 +1,80 @@
+import errno
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Set, Tuple
+
+import fitz
+
+# PyMuPDF is not thread safe, all use of fitz objects must hold this lock
+FITZ_LOCK = threading.RLock()
+
+
+class DocumentPool:
+    """ Keep recently used PDF documents open to avoid parsing them again.
+
+        Documents are evicted in LRU order and reopened if the file has been
+        modified since it was opened. Blocked paths, e.g. files being moved, are
+        not opened until they are unblocked.
+    """
+    def __init__(self, size: int = 4):
+        self.size = size
+        self._documents: 'OrderedDict[Path, Tuple[int, fitz.Document]]' = OrderedDict()
+        self._blocked: Set[Path] = set()
+        self._lock = FITZ_LOCK
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, path: Path) -> bool:
+        return Path(path) in self._documents
+
+    def get(self, path: Path) -> fitz.Document:
+        """ Return an open document for the path """
+        path = Path(path)
+        mtime = path.stat().st_mtime_ns
+
+        with self._lock:
+            if path in self._blocked:
+                raise OSError(errno.EBUSY, 'File is being transferred', str(path))
+
+            if path in self._documents:
+                opened_mtime, pdf = self._documents[path]
+                if opened_mtime == mtime:
+                    self._documents.move_to_end(path)
+                    return pdf
+
+                # The file has changed on disk
+                del self._documents[path]
+                pdf.close()
+
+            pdf = fitz.open(path)
+            self._documents[path] = (mtime, pdf)
+
+            while len(self._documents) > self.size:
+                _, (_, evicted) = self._documents.popitem(last=False)
+                evicted.close()
+
+            return pdf
+
+    def release(self, path: Path) -> None:
+        """ Close the document so the file can be moved or deleted """
+        with self._lock:
+            if (entry := self._documents.pop(Path(path), None)) is not None:
+                entry[1].close()
+
+    def block(self, path: Path) -> None:
+        """ Close the document and refuse to open it until unblock() """
+        with self._lock:
+            self._blocked.add(Path(path))
+        self.release(path)
+
+    def unblock(self, path: Path) -> None:
+        with self._lock:
+            self._blocked.discard(Path(path))
+
+    def close(self) -> None:
+        with self._lock:
+            for _, pdf in self._documents.values():
+                pdf.close()
+            self._documents.clear()
@@ -0,0 +1,226 @@
+""" Field filters for the document search, like `status:pending folder:import date:>=2026-10-01`.
+
+    Filters are answered from secondary indexes over model.DocumentInfo, so the
+    cost of a filter follows the number of matches rather than the number of rows.
+"""
+import bisect
+import shlex
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import model
+from search_index import SearchIndex
+
+FIELDS = ('status', 'source', 'dst_folder', 'folder', 'date', 'name')
+DATE_OPERATORS = ('>=', '<=', '>', '<', '=')
+
+
+@dataclass
+class Filter:
+    field: str
+    value: str
+    operator: str = '='
+
+@dataclass
+class Query:
+    filters: List[Filter] = field(default_factory=list)
+    text: str = ''
+
+    def __bool__(self) -> bool:
+        return bool(self.filters or self.text)
+
+
+def parse_query(query: str) -> Query:
+    """ Split a query into field filters and the remaining free text.
+        Words with an unknown field name are kept as free text.
+    """
+    try:
+        words = shlex.split(query)
+    except ValueError:
+        # Unbalanced quotes
+        words = query.split()
+
+    parsed = Query()
+    text = []
+    for word in words:
+        name, sep, value = word.partition(':')
+        name = name.lower()
+        if not sep or name not in FIELDS or not value:
+            text.append(word)
+            continue
+
+        operator = '='
+        if name == 'date':
+            operator = next((op for op in DATE_OPERATORS if value.startswith(op)), '=')
+            value = value[len(operator):] if value.startswith(operator) else value
+        parsed.filters.append(Filter(name, value, operator))
+
+    parsed.text = ' '.join(text)
+    return parsed
+
+def parse_date(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def date_bounds(f: Filter) -> Optional[Tuple[Optional[datetime], Optional[datetime], bool, bool]]:
+    """ (low, high, include_low, include_high) for a date filter, None if the date is invalid """
+    date = parse_date(f.value)
+    if date is None:
+        return None
+
+    # A date without a time covers the whole day
+    day = len(f.value) <= 10
+    end = date + timedelta(days=1) if day else date
+    if f.operator == '=':
+        return (date, end, True, not day)
+    elif f.operator == '>=':
+        return (date, None, True, True)
+    elif f.operator == '>':
+        return (end, None, day, True)
+    elif f.operator == '<=':
+        return (None, end, True, not day)
+    else:
+        return (None, date, True, False)
+
+def folder_key(folder) -> Optional[str]:
+    return folder.name.lower() if folder is not None else None
+
+
+class SortedIndex:
+    """ Keys ordered by a value, for range lookups """
+    def __init__(self):
+        self._values: List = []
+        self._keys: List[Hashable] = []
+
+    def add(self, value, key: Hashable) -> None:
+        i = bisect.bisect_right(self._values, value)
+        self._values.insert(i, value)
+        self._keys.insert(i, key)
+
+    def remove(self, value, key: Hashable) -> None:
+        i = bisect.bisect_left(self._values, value)
+        j = bisect.bisect_right(self._values, value)
+        i += self._keys[i:j].index(key)
+        del self._values[i]
+        del self._keys[i]
+
+    def range(self, low=None, high=None, include_low: bool = True, include_high: bool = True) -> Set[Hashable]:
+        if low is None:
+            i = 0
+        else:
+            i = (bisect.bisect_left if include_low else bisect.bisect_right)(self._values, low)
+        if high is None:
+            j = len(self._values)
+        else:
+            j = (bisect.bisect_right if include_high else bisect.bisect_left)(self._values, high)
+        return set(self._keys[i:j])
+
+
+class DocumentIndex:
+    """ Secondary indexes over documents: hash indexes for status and folders, a
+        sorted index for dates and an n-gram index for names.
+    """
+    def __init__(self):
+        self._status: Dict[model.Status, Set[Hashable]] = defaultdict(set)
+        self._source: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._dst_folder: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._date = SortedIndex()
+        self._name = SearchIndex()
+        self._indexed: Dict[Hashable, Tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._indexed)
+
+    def update(self, key: Hashable, document: model.DocumentInfo) -> bool:
+        """ Index the fields of document, returns False if none of them changed """
+        fields = (document.status, folder_key(document.source), folder_key(document.dst_folder), document.date)
+        old = self._indexed.get(key)
+        if old == fields:
+            self._name.update(key, document.name)
+            return False
+
+        if old is not None:
+            self._remove_fields(key, old)
+        self._indexed[key] = fields
+
+        status, source, dst_folder, date = fields
+        self._status[status].add(key)
+        if source is not None:
+            self._source[source].add(key)
+        if dst_folder is not None:
+            self._dst_folder[dst_folder].add(key)
+        self._date.add(date, key)
+        self._name.update(key, document.name)
+        return True
+
+    def remove(self, key: Hashable) -> None:
+        if (fields := self._indexed.pop(key, None)) is not None:
+            self._remove_fields(key, fields)
+            self._name.remove(key)
+
+    def lookup(self, f: Filter) -> Set[Hashable]:
+        """ Keys of the documents that pass the filter """
+        if f.field == 'status':
+            status = model.Status.__members__.get(f.value.upper())
+            return set(self._status.get(status, ()))
+        elif f.field == 'source':
+            return set(self._source.get(f.value.lower(), ()))
+        elif f.field == 'dst_folder':
+            return set(self._dst_folder.get(f.value.lower(), ()))
+        elif f.field == 'folder':
+            return self._source.get(f.value.lower(), set()) | self._dst_folder.get(f.value.lower(), set())
+        elif f.field == 'name':
+            return self._name.search(f.value)
+        elif f.field == 'date':
+            return self._lookup_date(f)
+        raise ValueError(f'Unknown field {f.field!r}')
+
+    def evaluate(self, filters: List[Filter]) -> Set[Hashable]:
+        """ Keys that pass every filter, intersecting the smallest sets first """
+        results = sorted((self.lookup(f) for f in filters), key=len)
+        if not results:
+            return set()
+        return results[0].intersection(*results[1:])
+
+    def _lookup_date(self, f: Filter) -> Set[Hashable]:
+        bounds = date_bounds(f)
+        return self._date.range(*bounds) if bounds is not None else set()
+
+    def _remove_fields(self, key: Hashable, fields: Tuple) -> None:
+        status, source, dst_folder, date = fields
+        self._status[status].discard(key)
+        if source is not None:
+            self._source[source].discard(key)
+        if dst_folder is not None:
+            self._dst_folder[dst_folder].discard(key)
+        self._date.remove(date, key)
+
+
+def matches(query: Query, document: model.DocumentInfo) -> bool:
+    """ Check the filters of query against a single document """
+    for f in query.filters:
+        value = f.value.lower()
+        if f.field == 'status':
+            ok = document.status.name.lower() == value
+        elif f.field == 'source':
+            ok = folder_key(document.source) == value
+        elif f.field == 'dst_folder':
+            ok = folder_key(document.dst_folder) == value
+        elif f.field == 'folder':
+            ok = value in (folder_key(document.source), folder_key(document.dst_folder))
+        elif f.field == 'name':
+            ok = value in document.name.lower()
+        else:
+            bounds = date_bounds(f)
+            if bounds is None:
+                return False
+            low, high, include_low, include_high = bounds
+            ok = ((low is None or document.date > low or include_low and document.date == low) and
+                  (high is None or document.date < high or include_high and document.date == high))
+        if not ok:
+            return False
+    return True
@@ -0,0 +1,229 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from scan_index import ScanDelta, ScanIndex
+
+logger = logging.getLogger(__name__)
+
+# Filesystems where inotify only sees changes made by this machine
+NETWORK_FILESYSTEMS = {'cifs', 'smb3', 'smbfs', 'nfs', 'nfs4', 'afs', '9p', 'fuse.sshfs'}
+
+
+class Inotify:
+    """ Minimal ctypes binding for Linux inotify """
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o0004000
+
+    MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = libc.inotify_init1(self.IN_CLOEXEC | self.IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self._watches: Dict[int, Path] = {}
+
+    @staticmethod
+    def is_available() -> bool:
+        if not sys.platform.startswith('linux'):
+            return False
+        libc_name = ctypes.util.find_library('c')
+        return libc_name is not None and hasattr(ctypes.CDLL(libc_name), 'inotify_init1')
+
+    def add_watch(self, folder: Path) -> None:
+        wd = self._add_watch(self.fd, os.fsencode(folder), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {folder}')
+        self._watches[wd] = folder
+
+    def read(self, timeout: float) -> List[tuple]:
+        """ Wait for events and return them as (folder, name, mask) tuples """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            events.append((self._watches.get(wd), os.fsdecode(name), mask))
+
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def is_network_folder(folder: Path) -> bool:
+    """ Check if the folder is on a filesystem inotify can't watch reliably """
+    try:
+        with open('/proc/mounts') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return True
+
+    path = os.path.realpath(folder)
+    best, fstype = '', None
+    for mount_point, fs in mounts:
+        mount_point = mount_point.replace('\\040', ' ')
+        if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > len(best):
+            best, fstype = mount_point, fs
+
+    return fstype in NETWORK_FILESYSTEMS
+
+
+class FolderWatcher(threading.Thread):
+    """ Watch source folders in the background and queue scan deltas.
+
+        Local folders are watched with inotify when available, others are polled.
+        Bursts of events are coalesced for `settle_delay` seconds before the scan index
+        is updated, and the resulting deltas are put on `deltas` for the GUI thread.
+    """
+    def __init__(self, index: ScanIndex, folders: Iterable[Path], **kwargs):
+        super().__init__(name='FolderWatcher', daemon=True)
+        self.index = index
+        self.folders = list(folders)
+        self.settle_delay = kwargs.get('settle_delay', 0.5)
+        self.max_delay = kwargs.get('max_delay', 2.0)
+        self.poll_interval = kwargs.get('poll_interval', 5.0)
+        self.use_inotify = kwargs.get('use_inotify', True)
+
+        self.deltas: 'queue.Queue[ScanDelta]' = queue.Queue()
+
+        self._stop_event = threading.Event()
+        self._inotify: Optional[Inotify] = None
+        self._polled: List[Path] = []
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        self._setup()
+
+        try:
+            # Pick up anything that changed while the program was closed
+            self._publish(self.index.rescan(self.folders))
+            self._loop()
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+
+    def _setup(self) -> None:
+        self._polled = list(self.folders)
+
+        if not (self.use_inotify and Inotify.is_available()):
+            return
+
+        try:
+            self._inotify = Inotify()
+        except OSError as e:
+            logger.warning(f'inotify unavailable, polling all folders: {e}')
+            return
+
+        self._polled = []
+        for folder in self.folders:
+            if is_network_folder(folder):
+                self._polled.append(folder)
+                continue
+            try:
+                self._inotify.add_watch(folder)
+            except OSError as e:
+                logger.warning(f'Polling {folder}: {e}')
+                self._polled.append(folder)
+
+    def _loop(self) -> None:
+        pending: Set[Path] = set()
+        rescan: Set[Path] = set()
+        first_event = last_event = None
+        next_poll = time.monotonic() + self.poll_interval
+
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            timeout = next_poll - now
+            if first_event is not None:
+                timeout = min(timeout, last_event + self.settle_delay - now, first_event + self.max_delay - now)
+
+            events = self._read_events(max(timeout, 0))
+
+            for folder, name, mask in events:
+                if mask & Inotify.IN_Q_OVERFLOW:
+                    # Events were lost, rescan every watched folder
+                    rescan.update(f for f in self.folders if f not in self._polled)
+                elif folder is None:
+                    continue
+                elif mask & (Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF):
+                    rescan.add(folder)
+                elif name:
+                    pending.add(folder / name)
+
+            now = time.monotonic()
+            if events:
+                first_event = first_event if first_event is not None else now
+                last_event = now
+
+            if first_event is not None and (now - last_event >= self.settle_delay or now - first_event >= self.max_delay):
+                self._flush(pending, rescan)
+                pending, rescan = set(), set()
+                first_event = last_event = None
+
+            if now >= next_poll:
+                if self._polled:
+                    self._publish(self.index.rescan(self._polled))
+                next_poll = now + self.poll_interval
+
+    def _read_events(self, timeout: float) -> List[tuple]:
+        if self._inotify is None:
+            self._stop_event.wait(timeout)
+            return []
+
+        # Wake up regularly so stop() is noticed
+        return self._inotify.read(min(timeout, 1.0))
+
+    def _flush(self, paths: Set[Path], folders: Set[Path]) -> None:
+        delta = self.index.rescan(folders) if folders else ScanDelta()
+        delta.extend(self.index.update_paths(p for p in paths if p.parent not in folders))
+        self._publish(delta)
+
+    def _publish(self, delta: ScanDelta) -> None:
+        if delta:
+            self.deltas.put(delta)
@@ -0,0 +1,89 @@
+import logging
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts5(text);
+"""
+
+
+def match_expression(query: str) -> Optional[str]:
+    """ FTS5 expression where every word of query has to start a word in the text """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return ' AND '.join(f'"{w}"*' for w in words)
+
+
+class FullTextIndex:
+    """ SQLite FTS5 index of document text, keyed by path and mtime.
+
+        The connection is shared between the extractor thread and the Tk thread,
+        so every statement runs under a lock. The database is in WAL mode, which
+        keeps commits cheap.
+    """
+    def __init__(self, db_file: Path = Path(':memory:')):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def mtime(self, path: Path) -> Optional[int]:
+        with self._lock:
+            row = self._db.execute('SELECT mtime FROM documents WHERE path = ?', (str(path),)).fetchone()
+        return row[0] if row else None
+
+    def add(self, path: Path, mtime: int, text: str) -> None:
+        """ Index text for path, replacing an older version """
+        with self._lock, self._db:
+            self._delete(path)
+            cursor = self._db.execute('INSERT INTO documents (path, mtime) VALUES (?, ?)', (str(path), mtime))
+            self._db.execute('INSERT INTO document_text (rowid, text) VALUES (?, ?)', (cursor.lastrowid, text))
+
+    def remove(self, paths: Iterable[Path]) -> None:
+        with self._lock, self._db:
+            for path in paths:
+                self._delete(path)
+
+    def search(self, query: str) -> Set[Path]:
+        """ Paths of documents containing words that start with every word in query """
+        expression = match_expression(query)
+        if expression is None:
+            return set()
+
+        with self._lock:
+            try:
+                rows = self._db.execute(
+                    'SELECT d.path FROM document_text JOIN documents d ON d.id = document_text.rowid '
+                    'WHERE document_text MATCH ?', (expression,)).fetchall()
+            except sqlite3.OperationalError as e:
+                logger.debug(f'Full text query {expression!r} failed: {e}')
+                return set()
+        return {Path(path) for path, in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _delete(self, path: Path) -> None:
+        row = self._db.execute('SELECT id FROM documents WHERE path = ?', (str(path),)).fetchone()
+        if row is not None:
+            self._db.execute('DELETE FROM document_text WHERE rowid = ?', row)
+            self._db.execute('DELETE FROM documents WHERE id = ?', row)
+
@@ -1,5 +1,6 @@
+import collections
 import ctypes
-import shutil
+import queue
 import tkinter as tk
 from dataclasses import asdict
 from pathlib import Path
@@ -7,17 +8,28 @@ from tkinter import ttk
 from tkinter.filedialog import askdirectory
 from typing import Dict, List, Optional
 
+import folder_watcher
+import fulltext_index
+import hashing
+import journal
+import metadata_extractor
 import model
+import number_allocator
+import pdf_reader
 import pdf_viewer
+import scan_index
+import state_store
+import transfer
 from item_treeview import DocumentInfoTree
-import pickle
 
 class Event:
     DO_UPDATE_DOCUMENTS = '<<DO_UPDATE_DOCUEMENTS>>'
     DO_SEARCH_DOCUMENTS = '<<DO_SEARCH_DOCUMENTS>>'
     DO_MOVE_DOCUMENTS = '<<DO_MOVE_DOCUMENTS>>'
+    DO_CANCEL_MOVE = '<<DO_CANCEL_MOVE>>'
     DO_DOCUMENT_SELECTED = '<<DO_DOCUMENT_SELECTED>>'
     DO_REGISTER_DOCUMENT = '<<DO_REGISTER_DOCUMENT>>'
+    DO_DOCUMENTS_SCROLLED = '<<DO_DOCUMENTS_SCROLLED>>'
 
 
 class NumberSeriesEditor(tk.Frame):
@@ -29,24 +41,44 @@ class NumberSeriesEditor(tk.Frame):
         gui_list.insert('end', *self.numberseries)
 
 class DocumentOverview(ttk.Frame):
+    # Milliseconds without typing before the search is run
+    SEARCH_DELAY = 200
+
     def __init__(self, master, **kwargs):
         super().__init__(master, **kwargs)
 
         self.var_search_query = tk.StringVar()
+        self.var_search_query.trace_add('write', self._on_query_changed)
+        self._search_id = None
+        self.var_move = tk.BooleanVar(value=False)
 
         f_buttons = ttk.Frame(self)
         f_buttons.pack(side='top', fill='x')
 
-        ttk.Entry(f_buttons, textvariable=self.var_search_query).pack(side='left')
+        search_entry = ttk.Entry(f_buttons, textvariable=self.var_search_query)
+        search_entry.pack(side='left')
+        search_entry.bind('<Return>', lambda _: self.on_search())
         ttk.Button(f_buttons, text='Søk', command=self.on_search).pack(side='left')
         ttk.Button(f_buttons, text='Oppdater', command=self.on_update_documents).pack(side='left')
         ttk.Button(f_buttons, text='Bekreft', command=self.on_confirm_change).pack(side='left')
+        ttk.Button(f_buttons, text='Avbryt', command=self.on_cancel_move).pack(side='left')
+        ttk.Checkbutton(f_buttons, text='Flytt', variable=self.var_move).pack(side='left')
+
+        f_progress = ttk.Frame(self)
+        f_progress.pack(side='bottom', fill='x')
+
+        self.var_progress = tk.DoubleVar()
+        self.var_progress_text = tk.StringVar()
+        ttk.Progressbar(f_progress, variable=self.var_progress, maximum=1.0).pack(side='left', fill='x', expand=True)
+        ttk.Label(f_progress, textvariable=self.var_progress_text).pack(side='left')
 
         self.documents = DocumentInfoTree(self)
+        self._last_selected = None
         self.documents.pack(side='top', fill='both', expand=True)
 
         self.documents.bind('<<TreeviewSelect>>', self.on_document_selected)
         self.documents.bind('<F3>', self._on_register_document)
+        self.documents.bind('<<TreeviewScrolled>>', self._on_documents_scrolled)
     
     @property
     def selected_document(self) -> Optional[model.DocumentInfo]:
@@ -55,10 +87,40 @@ class DocumentOverview(ttk.Frame):
         else:
             return None
     
+    @property
+    def move_documents(self) -> bool:
+        """ Remove documents from the source folder when they are confirmed """
+        return self.var_move.get()
+
+    @property
+    def visible_documents(self) -> List[model.DocumentInfo]:
+        return [adapter.item for adapter in self.documents.visible_items()]
+
+    def neighbour_documents(self, count: int) -> List[model.DocumentInfo]:
+        return [adapter.item for adapter in self.documents.neighbours(count)]
+
     def update_document(self, documentinfo: model.DocumentInfo) -> None:
         self.documents.update_object(documentinfo)
+
+    def update_documents(self, documents: List[model.DocumentInfo]) -> None:
+        self.documents.update_objects(documents)
+
+    def apply_changes(self, added: List[model.DocumentInfo], removed: List[model.DocumentInfo], changed: List[model.DocumentInfo]) -> None:
+        """ Update only the rows that have been added, removed or changed """
+        self.documents.delete_objects(removed)
+        self.documents.update_objects(changed)
+        self.documents.update_objects(added)
         
+    def _on_query_changed(self, *args) -> None:
+        if self._search_id is not None:
+            self.after_cancel(self._search_id)
+        self._search_id = self.after(self.SEARCH_DELAY, self.on_search)
+
     def on_search(self) -> None:
+        if self._search_id is not None:
+            self.after_cancel(self._search_id)
+            self._search_id = None
+
         self.documents.searcher(self.var_search_query.get())
         self.event_generate(Event.DO_SEARCH_DOCUMENTS)
     
@@ -67,20 +129,53 @@ class DocumentOverview(ttk.Frame):
     
     def on_confirm_change(self) -> None:
         self.event_generate(Event.DO_MOVE_DOCUMENTS)
+
+    def on_cancel_move(self) -> None:
+        self.event_generate(Event.DO_CANCEL_MOVE)
+
+    def show_progress(self, progress: float, text: str) -> None:
+        self.var_progress.set(progress)
+        self.var_progress_text.set(text)
+
+    def show_status(self, text: str) -> None:
+        self.var_progress_text.set(text)
     
     def on_document_selected(self, event = None) -> None:
+        # Rows are recycled while scrolling, which changes the selection of the widget
+        if (selected := self.selected_document) is self._last_selected:
+            return
+        self._last_selected = selected
         self.event_generate(Event.DO_DOCUMENT_SELECTED)
 
     def _on_register_document(self, event = None) -> None:
         self.event_generate(Event.DO_REGISTER_DOCUMENT)
 
+    def _on_documents_scrolled(self, event = None) -> None:
+        self.event_generate(Event.DO_DOCUMENTS_SCROLLED)
+
 class App:
-    def __init__(self, series, mappings):
+    WATCH_INTERVAL = 250
+    WATCH_BATCH_SIZE = 500
+    TRANSFER_INTERVAL = 100
+    PREFETCH_COUNT = 2
+    SAVE_INTERVAL = 60000
+
+    def __init__(self, series, mappings, index: Optional[scan_index.ScanIndex] = None, transfer_journal: Optional[journal.TransferJournal] = None, hasher: Optional[hashing.ContentHasher] = None, extractor: Optional[metadata_extractor.MetadataExtractor] = None, store: Optional[state_store.StateStore] = None):
         self.gui = tk.Tk()
 
         self.numberseries: Dict[str, model.NumberSeries] = series
         self.dst: List[model.FolderMapping] = mappings
-        self.documents: List[model.DocumentInfo] = []
+        self.documents: Dict[Path, model.DocumentInfo] = {}
+        self.scan_index = index if index is not None else scan_index.ScanIndex()
+        self.watcher: Optional[folder_watcher.FolderWatcher] = None
+        self._delta_batches: 'collections.deque[scan_index.ScanDelta]' = collections.deque()
+        self.hasher = hasher if hasher is not None else hashing.ContentHasher()
+        self._checksum_groups: Dict[str, List[model.DocumentInfo]] = {}
+        self.extractor = extractor if extractor is not None else metadata_extractor.MetadataExtractor(index=fulltext_index.FullTextIndex())
+        self._prioritize_id = None
+        self.journal = transfer_journal
+        self.store = store if store is not None else state_store.StateStore()
+        self.scheduler = transfer.CopyScheduler(journal=self.journal)
         
         self.pdf_viewer = pdf_viewer.PdfViewer()
 
@@ -90,40 +185,338 @@ class App:
         self.document_overview.bind(Event.DO_UPDATE_DOCUMENTS, self.on_update_documents)
         self.document_overview.bind(Event.DO_DOCUMENT_SELECTED, self.on_selected_document)
         self.document_overview.bind(Event.DO_MOVE_DOCUMENTS, self.on_move_documents)
+        self.document_overview.bind(Event.DO_CANCEL_MOVE, self.on_cancel_move)
         # self.document_overview.bind(Event.DO_SELECT_FOLDER, self.db.select_location)
         self.document_overview.bind(Event.DO_REGISTER_DOCUMENT, self.register_document)
+        self.document_overview.bind(Event.DO_DOCUMENTS_SCROLLED, self.on_documents_scrolled)
+        # Search the text inside the documents as well as the listed columns
+        if self.extractor.index is not None:
+            self.document_overview.documents.fulltext = self.extractor.index.search
 
         panes.pack(side='top', expand=True, fill='both')
         panes.add(self.document_overview, weight=1)
         panes.add(self.viewer_frame, weight=1)
 
+        self.load_indexed_documents()
+
+        if self.journal is not None:
+            self.restore_series(self.journal.last_header().get('series', {}))
+
+        # Mappings may still be added before the mainloop starts
+        self.gui.after_idle(self.start_watching)
+        self.gui.after_idle(self.resume_transfers)
+        self.gui.after(self.WATCH_INTERVAL, self._apply_checksums)
+
+        self.extractor.start()
+        self.gui.after(self.WATCH_INTERVAL, self._apply_metadata)
+        self.gui.after(self.SAVE_INTERVAL, self._save_caches)
+
+    @property
+    def sources(self) -> List[Path]:
+        return [m.source for m in self.dst]
+
+    def load_indexed_documents(self) -> None:
+        """ Show the documents from the last scan without touching the folders """
+        sources = set(self.sources)
+        entries = [e for e in self.scan_index.entries if e.path.parent in sources]
+        # Registered documents keep their state between sessions
+        stored = self.store.documents(e.path for e in entries)
+        self.documents = {e.path: stored.get(e.path) or model.DocumentInfo(e.path) for e in entries}
+        self.document_overview.documents.content = self.documents.values()
+        self.hasher.submit(entries)
+        self.extractor.submit(entries)
+
+    def start_watching(self) -> None:
+        """ Watch the source folders and apply changes as they happen """
+        self.stop_watching()
+        self.watcher = folder_watcher.FolderWatcher(self.scan_index, self.sources)
+        self.watcher.start()
+        self.gui.after(self.WATCH_INTERVAL, self._apply_watched_changes)
+
+    def stop_watching(self) -> None:
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def _apply_watched_changes(self) -> None:
+        """ Apply queued deltas from the watcher in batches on the Tk thread """
+        if self.watcher is None:
+            return
+
+        applied = 0
+        while applied < self.WATCH_BATCH_SIZE:
+            if not self._delta_batches:
+                try:
+                    delta = self.watcher.deltas.get_nowait()
+                except queue.Empty:
+                    break
+                # A rescan can find thousands of files, they are applied over several intervals
+                self._delta_batches.extend(delta.split(self.WATCH_BATCH_SIZE))
+                continue
+            batch = self._delta_batches.popleft()
+            self.apply_scan_delta(batch)
+            applied += len(batch)
+
+        self.gui.after(self.WATCH_INTERVAL, self._apply_watched_changes)
+
     def on_update_documents(self, event = None) -> None:
-        self.documents = []
-        for mapping in self.dst:
-            for f in mapping.source.glob('*.pdf'):
-                self.documents.append(model.DocumentInfo(f))
-        self.document_overview.documents.content = self.documents
-        
-        # Reset numberseries to last saved default values
-        for ns in self.numberseries.values():
-            ns.reset()
+        delta = self.scan_index.rescan(self.sources)
+        self.apply_scan_delta(delta)
+
+        if delta:
+            self.scan_index.save()
+
+    def apply_scan_delta(self, delta: scan_index.ScanDelta) -> None:
+        """ Update documents with the files added, removed or changed since last scan.
+            Documents that are unchanged keep their status.
+        """
+        added, removed, changed = [], [], []
+        new_entries = list(delta.added)
+        hash_entries = list(delta.added)
+
+        self.extractor.discard(e.path for e in delta.removed)
+
+        for entry in delta.removed:
+            d = self.documents.get(entry.path)
+            # Registered documents stay listed, their source is removed when moved
+            if d is not None and d.status == model.Status.OK:
+                removed.append(self.documents.pop(entry.path))
+                self._forget_checksum(d)
+
+        for entry in delta.changed:
+            hash_entries.append(entry)
+            if (d := self.documents.get(entry.path)) is not None:
+                changed.append(d)
+                self._forget_checksum(d)
+            else:
+                new_entries.append(entry)
+
+        # Files registered before a crash may not be in the saved scan index
+        stored = self.store.documents(e.path for e in new_entries if e.path not in self.documents)
+        for entry in new_entries:
+            if (d := self.documents.get(entry.path)) is not None:
+                if d.moved_to is None:
+                    continue
+                # A new file has taken the place of one that was moved away
+                removed.append(d)
+                d = model.DocumentInfo(entry.path)
+            else:
+                d = stored.get(entry.path) or model.DocumentInfo(entry.path)
+            self.documents[entry.path] = d
+            added.append(d)
+
+        self.document_overview.apply_changes(added, removed, changed)
+        if self.extractor.index is not None:
+            self.extractor.index.remove(d.link for d in removed)
+        self.hasher.submit(hash_entries)
+        self.extractor.submit(hash_entries)
+
+    def _apply_checksums(self) -> None:
+        """ Group documents by checksum as results come in and flag duplicates """
+        applied = 0
+        while applied < self.WATCH_BATCH_SIZE:
+            try:
+                path, checksum = self.hasher.results.get_nowait()
+            except queue.Empty:
+                break
+            applied += 1
+
+            d = self.documents.get(path)
+            if d is None or d.checksum == checksum:
+                continue
+
+            self._forget_checksum(d)
+            d.checksum = checksum
+            group = self._checksum_groups.setdefault(checksum, [])
+            group.append(d)
+            self._flag_duplicates(group)
+
+        self.gui.after(self.WATCH_INTERVAL, self._apply_checksums)
+
+    def on_documents_scrolled(self, event = None) -> None:
+        """ Parse the rows in view first, scrolling is coalesced to one update per interval """
+        if self._prioritize_id is None:
+            self._prioritize_id = self.gui.after(self.WATCH_INTERVAL, self._prioritize_visible)
+
+    def _prioritize_visible(self) -> None:
+        self._prioritize_id = None
+        self.extractor.prioritize(Path(d.link) for d in self.document_overview.visible_documents)
+
+    def _apply_metadata(self) -> None:
+        """ Fill in the parsed columns, one tree update per batch of results """
+        updated = []
+        while len(updated) < self.WATCH_BATCH_SIZE:
+            try:
+                result = self.extractor.results.get_nowait()
+            except queue.Empty:
+                break
+
+            d = self.documents.get(Path(result.link))
+            if d is None or d.metadata == result.info:
+                continue
+            d.metadata = result.info
+            updated.append(d)
+
+        if updated:
+            self.document_overview.update_documents(updated)
+
+        self.gui.after(self.WATCH_INTERVAL, self._apply_metadata)
+
+    def _save_caches(self) -> None:
+        """ Keep the checksums and parsed headers found so far if the program crashes """
+        self.hasher.save()
+        self.extractor.cache.save()
+        self.gui.after(self.SAVE_INTERVAL, self._save_caches)
+
+    def _forget_checksum(self, d: model.DocumentInfo) -> None:
+        if d.checksum is None:
+            return
+
+        group = self._checksum_groups.get(d.checksum, [])
+        if d in group:
+            group.remove(d)
+        if group:
+            self._flag_duplicates(group)
+        else:
+            self._checksum_groups.pop(d.checksum, None)
+
+        d.checksum = None
+        if d.duplicate_of is not None:
+            d.duplicate_of = None
+            self.document_overview.update_document(d)
+
+    def _flag_duplicates(self, group: List[model.DocumentInfo]) -> None:
+        """ Keep the first registered document, or else the first one seen, as the original """
+        original = next((d for d in group if d.status != model.Status.OK), group[0])
+
+        for d in group:
+            duplicate_of = None if d is original else original.link
+            if d.duplicate_of != duplicate_of:
+                d.duplicate_of = duplicate_of
+                self.document_overview.update_document(d)
     
     def on_selected_document(self, event = None) -> None:
         if f := self.document_overview.selected_document:
-            self.pdf_viewer.display(Path(f.link))
+            self.pdf_viewer.display(Path(f.location))
+
+            # Get the next documents ready while this one is read
+            neighbours = self.document_overview.neighbour_documents(self.PREFETCH_COUNT)
+            self.pdf_viewer.prefetch([Path(d.location) for d in neighbours])
 
     def on_move_documents(self, event = None) -> None:
-        pending_documents = (d for d in self.documents if d.is_pending)
+        if self.scheduler.is_running:
+            return
+
+        move = self.document_overview.move_documents
+        jobs = []
+        for d in self.documents.values():
+            if not d.is_pending or d.is_duplicate:
+                continue
+            # Sizes come from the last scan, a stat per file would block on a slow share
+            entry = self.scan_index.get(d.link)
+            size = entry.size if entry is not None else 0
+            jobs.append(transfer.TransferJob(d.link, d.dst_folder / f'{d.name}', size, d, move))
+
+        if not jobs:
+            return
+
+        # Open handles would keep the sources from being moved on Windows, the viewer
+        # doesn't open them again until their result is in
+        self.pdf_viewer.cancel_prefetch()
+        for job in jobs:
+            self.pdf_viewer.block(job.source)
+
+        # Numbers handed out so far are stored with the batch, so they are never reused
+        header = {'series': {p: ns.current_number for p, ns in self.numberseries.items()}}
+        self.scheduler.start(jobs, header)
+        self.gui.after(self.TRANSFER_INTERVAL, self._apply_transfer_results)
+
+    def resume_transfers(self) -> None:
+        """ Continue a batch that was interrupted, skipping files already transferred """
+        if self.journal is None or self.scheduler.is_running:
+            return
+
+        batch = self.journal.unfinished()
+        if batch is None:
+            return
+
+        self.restore_series(batch.header.get('series', {}))
+
+        added = []
+        for job in batch.jobs:
+            d = self.documents.get(job.source)
+            if d is None:
+                d = model.DocumentInfo(job.source)
+                self.documents[job.source] = d
+                added.append(d)
+            d.name = job.target.name
+            d.dst_folder = job.target.parent
+            d.status = model.Status.PENDING
+            job.document = d
+
+        for job in batch.done:
+            self._mark_transferred(job)
+        self.store.save(j.document for j in batch.jobs)
+
+        self.document_overview.apply_changes(added, [], [j.document for j in batch.jobs])
+
+        for job in batch.remaining:
+            self.pdf_viewer.block(job.source)
+
+        self.journal.resume(batch)
+        self.scheduler.resume(batch.remaining)
+        self.gui.after(self.TRANSFER_INTERVAL, self._apply_transfer_results)
+
+    def restore_series(self, series: Dict[str, int]) -> None:
+        """ Move number series forward past numbers that are already in use """
+        restarted = []
+        for prefix, number in series.items():
+            ns = self.numberseries.get(prefix)
+            if ns is not None and number > ns.number:
+                ns.restart_series(number)
+                restarted.append(ns)
+        self.store.save(series=restarted)
+
+    def on_cancel_move(self, event = None) -> None:
+        self.scheduler.cancel()
+
+    def _apply_transfer_results(self) -> None:
+        """ Mark finished transfers as moved and report progress """
+        moved = []
+        while True:
+            try:
+                result = self.scheduler.results.get_nowait()
+            except queue.Empty:
+                break
+
+            self.pdf_viewer.unblock(result.job.source)
+            if result.ok:
+                self._mark_transferred(result.job)
+                self.document_overview.update_document(result.job.document)
+                moved.append(result.job.document)
+        self.store.save(moved)
+
+        self.document_overview.show_progress(self.scheduler.stats.progress, str(self.scheduler.stats))
+
+        if self.scheduler.is_running or not self.scheduler.results.empty():
+            self.gui.after(self.TRANSFER_INTERVAL, self._apply_transfer_results)
+            return
 
-        for d in pending_documents:
-            dst_name = d.dst_folder / f'{d.name}'
-            shutil.copy2(d.link, dst_name)
-            d.status = model.Status.MOVED
-            self.document_overview.update_document(d)
-        
         # Save the changes in numberseries
         for ns in self.numberseries.values():
             ns.save()
+        self.store.save(series=self.numberseries.values())
+
+        if self.journal is not None:
+            self.journal.end({'series': {p: ns.number for p, ns in self.numberseries.items()}})
+
+    def _mark_transferred(self, job: transfer.TransferJob) -> None:
+        d = job.document
+        d.status = model.Status.MOVED
+        if job.move:
+            d.moved_to = job.target
+            self.scan_index.forget([job.source])
+            self.pdf_viewer.release(job.source)
     
     def register_document(self, event = None) -> None:
         doc = self.document_overview.selected_document
@@ -131,41 +524,68 @@ class App:
         if doc is None:
             return
         
-        if doc.status != model.Status.OK:
+        if doc.status != model.Status.OK or doc.is_duplicate:
             return
         
         mapping = [m for m in self.dst if m.source == doc.source][0]
 
         num_ser = self.numberseries[mapping.prefix]
-        doc.name =num_ser.next()
+        try:
+            doc.name = num_ser.next()
+        except OSError:
+            # No shared numbers are reserved yet, e.g. while the share is offline. The
+            # document stays unregistered and more numbers are reserved in the background
+            self.document_overview.show_status(f'Fikk ikke reservert et nummer i serien {mapping.prefix} ennå, prøv igjen om litt')
+            return
         doc.dst_folder = mapping.destination
         doc.status = model.Status.PENDING
+        self.store.save([doc], [num_ser])
 
         self.document_overview.update_document(doc)
 
+def shared_series_file(store: state_store.StateStore) -> Path:
+    """ The number series file every station shares, asked for once and then stored """
+    value = store.setting('shared_series_file')
+    if value is None:
+        value = input('Shared number series file, the same path on every station: ').strip()
+        if not value:
+            raise SystemExit('A shared number series file is required, stations would hand out the same numbers without it')
+        store.save_setting('shared_series_file', value)
+    return Path(value)
+
 def main() -> None:
     pkl_ms = Path('ms.p')
     pkl_ns = Path('ns.p')
-    series = {}
-    mappings = []
-
-    if pkl_ms.exists():
-        with open(pkl_ms, 'rb') as m:
-            mappings = pickle.load(m)
-    
-    if pkl_ns.exists():
-        with open(pkl_ns, 'rb') as s:
-            series = pickle.load(s)
+    pkl_scan = Path('scan.p')
+    journal_file = Path('transfer.journal')
+    pkl_hash = Path('hash.p')
+    pkl_meta = Path('meta.p')
+    fulltext_db = Path('fulltext.db')
+    state_db = Path('state.db')
 
+    store = state_store.StateStore(state_db)
+    store.migrate_pickles(pkl_ms, pkl_ns)
+    series = store.series()
+    mappings = store.mappings()
+    series_file = shared_series_file(store)
 
     ctypes.windll.shcore.SetProcessDpiAwareness(1)
-    app = App(series, mappings)
+    app = App(
+        series, 
+        mappings, 
+        scan_index.ScanIndex(pkl_scan), 
+        journal.TransferJournal(journal_file), 
+        hashing.ContentHasher(pkl_hash),
+        metadata_extractor.MetadataExtractor(pdf_reader.MetadataCache(pkl_meta), index=fulltext_index.FullTextIndex(fulltext_db)),
+        store
+    )
 
     print(series)
     while input('Add numberseries? y/n ') == 'y':
         prefix = input('Series prefix: ')
         number = int(input('Number: '))
         series[prefix] = model.NumberSeries(prefix, number)
+        store.save(series=[series[prefix]])
         print(series)
     
     print(mappings)
@@ -175,14 +595,31 @@ def main() -> None:
         dest = Path(askdirectory(title='Select destination'))
 
         mappings.append(model.FolderMapping(source, dest, prefix))
+        store.save_mappings(mappings)
         print(mappings)
 
+    # Stations moving to the same archive share the number series through this file
+    allocator = number_allocator.NumberAllocator(series_file)
+    for ns in series.values():
+        ns.attach(allocator)
+
     print('Open GUI.')
     app.gui.mainloop()
 
-    with open(pkl_ms, 'wb') as m, open(pkl_ns, 'wb') as s:
-        pickle.dump(mappings, m)
-        pickle.dump(series, s)
+    app.stop_watching()
+    app.scheduler.shutdown()
+    app.journal.close()
+    app.hasher.shutdown()
+    app.hasher.save()
+    app.extractor.stop()
+    app.extractor.join()
+    app.extractor.cache.save()
+    app.extractor.index.close()
+    app.pdf_viewer.close()
+    app.scan_index.save()
+    for ns in series.values():
+        ns.release()
+    app.store.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import pickle_file
+from scan_index import ScanEntry
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_checksum(path: Path) -> str:
+    """ BLAKE2 checksum of the file content, read in chunks """
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ContentHasher:
+    """ Checksum files on a background pool.
+
+        Checksums are cached by path, size and mtime so every version of a file is
+        only read once. Results are put on `results` as (path, checksum) tuples.
+    """
+    def __init__(self, cache_file: Optional[Path] = None, max_workers: int = 2):
+        self.cache_file = cache_file
+        self.max_workers = max_workers
+
+        self.results: 'queue.Queue[Tuple[Path, str]]' = queue.Queue()
+
+        self._cache: Dict[Path, Tuple[int, int, str]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        if self.cache_file is not None and self.cache_file.exists():
+            self.load()
+
+    def load(self) -> None:
+        cache = pickle_file.load(self.cache_file, {})
+
+        with self._lock:
+            self._cache = cache
+            self._dirty = False
+
+    def save(self) -> None:
+        """ Write the cache to file if checksums were added since it was loaded or saved """
+        if self.cache_file is None:
+            return
+
+        with self._lock:
+            if not self._dirty:
+                return
+            cache = dict(self._cache)
+            self._dirty = False
+
+        pickle_file.save(self.cache_file, cache)
+
+    def cached(self, entry: ScanEntry) -> Optional[str]:
+        with self._lock:
+            size, mtime, checksum = self._cache.get(entry.path, (None, None, None))
+        return checksum if (size, mtime) == (entry.size, entry.mtime) else None
+
+    def submit(self, entries: Iterable[ScanEntry]) -> None:
+        """ Queue files for checksumming, cached checksums are reported right away """
+        for entry in entries:
+            if (checksum := self.cached(entry)) is not None:
+                self.results.put((entry.path, checksum))
+                continue
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='hasher')
+            self._executor.submit(self._hash, entry)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _hash(self, entry: ScanEntry) -> None:
+        try:
+            checksum = file_checksum(entry.path)
+            st = os.stat(entry.path)
+        except OSError as e:
+            logger.debug(f'Could not checksum {entry.path}: {e}')
+            return
+
+        # The file changed while it was read, a new scan entry will follow
+        if (st.st_size, st.st_mtime_ns) != (entry.size, entry.mtime):
+            return
+
+        with self._lock:
+            self._cache[entry.path] = (entry.size, entry.mtime, checksum)
+            self._dirty = True
+
+        self.results.put((entry.path, checksum))
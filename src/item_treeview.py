@@ -1,9 +1,29 @@
 import abc
+import bisect
+import math
+import time
+from collections import deque
 from tkinter import font, ttk
-from typing import Any, Dict, Tuple, TypeVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
 
+import document_query
 import model
 from scrollbar_treeview import ScrollbarTreeview
+from search_index import SearchIndex
+
+
+def typed_value(value) -> Tuple[int, Any]:
+    """ Sort key that orders numbers numerically and before text """
+    if isinstance(value, (int, float)):
+        return (0, value)
+    text = str(value)
+    # Only attempt a number parse on values that can be one, exceptions are slow
+    if not text or not (text[0].isdigit() or text[0] in '+-.'):
+        return (1, text.lower())
+    try:
+        return (0, float(text.replace(' ', '').replace(',', '.')))
+    except ValueError:
+        return (1, text.lower())
 
 
 class TreeviewAdapter(abc.ABC):
@@ -13,12 +33,34 @@ class TreeviewAdapter(abc.ABC):
         self.iid = None
         self.is_comments_allowed = True
 
+    @property
+    def item(self):
+        return self._item
+
+    @item.setter
+    def item(self, item):
+        # Assigning the item again marks it as changed
+        self._item = item
+        self._sort_keys = None
+
     @abc.abstractmethod
     def text(self): return
 
     @abc.abstractmethod
     def values(self): return
 
+    def column_key(self, column: int):
+        """ Comparable key for the value in column """
+        return typed_value(self.values()[column])
+
+    def sort_key(self, column: int):
+        """ Key for column, computed once for each item that is assigned """
+        if self._sort_keys is None:
+            self._sort_keys = {}
+        if column not in self._sort_keys:
+            self._sort_keys[column] = self.column_key(column)
+        return self._sort_keys[column]
+
     def tag(self, index) -> Tuple[str]:
         return ('odd',) if index % 2 else ('even',)
 
@@ -30,7 +72,8 @@ class TreeviewAdapter(abc.ABC):
         return f'<{item.__class__.__qualname__}({item.link})>'
 
 class DocumentInfoAdapter(TreeviewAdapter):
-    headings = ['DATE', 'FOLDER', 'NAME', 'STAUTS']
+    headings = ['DATE', 'FOLDER', 'NAME', 'STAUTS', 'SYSPED', 'TR', 'PO', 'ETD', 'ETA']
+    metadata_fields = ['sysped_ref', 'tr_no', 'po_no', 'etd', 'eta']
 
     def __init__(self, document_info):
         super().__init__(document_info)
@@ -49,42 +92,106 @@ class DocumentInfoAdapter(TreeviewAdapter):
         return self.item.link
     
     def tag(self, index):
-        if self.item.status == model.Status.PENDING:
+        if self.item.is_duplicate:
+            return ('duplicate', )
+        elif self.item.status == model.Status.PENDING:
             return ('pending', )
         elif self.item.status == model.Status.MOVED:
             return ('moved', )
         else:
             return super().tag(index)
     
+    def metadata(self) -> Tuple[str, ...]:
+        """ Fields parsed from the document, empty until the extractor has read it """
+        if self.item.metadata is None:
+            return ('',) * len(self.metadata_fields)
+        return tuple(getattr(self.item.metadata, f) for f in self.metadata_fields)
+
     def values(self):
         return (
             f'{self.item.date:%Y-%m-%d}',
             self.folder(),
             self.item.name,
-            self.item.status
+            self.item.status,
+            *self.metadata()
         )
+
+    def column_key(self, column):
+        # Dates and statuses sort by value rather than by their text
+        if column == 0:
+            return self.item.date
+        elif column == 1:
+            return self.folder().lower()
+        elif column == 2:
+            return self.item.name.lower()
+        elif column == 3:
+            return self.item.status.value
+        elif self.item.metadata is None:
+            return typed_value('')
+        return typed_value(getattr(self.item.metadata, self.metadata_fields[column - 4]))
     
-    def key(self) -> str:
-        return self.item.link
+    @staticmethod
+    def generate_key(item):
+        return item.link
 
 
 Adapter = TypeVar('Adapter', bound=DocumentInfoAdapter)
 
 class ItemTreeview(ttk.Treeview):
+    """ Treeview that displays adapters for a set of objects.
+
+        In virtual mode the rows are only kept in Python, and the widget holds the
+        rows in view plus a margin of one page above and below. Items are recycled
+        as the view is scrolled, which is driven by on_scroll() and needs the
+        treeview to be combined with ScrollbarTreeview.
+    """
+    # Seconds spent inserting rows before the event loop gets control back
+    INSERT_SLICE = 0.02
+
+    # Number of columns the rows are sorted by, the last clicked heading first
+    SORT_DEPTH = 3
+
+    # Rows added at once up to this many are inserted in place, more are sorted with the rest
+    SORTED_INSERT_LIMIT = 100
+
+    # Number of columns to search, all columns if None
+    _num_search_values: Optional[int] = None
+
     def __init__(self, master, adapter, *args, **kwargs):
+        self.virtual = kwargs.pop('virtual', False)
+        self._rows: List[Adapter] = []
+        self._window: List[str] = []
+        self._start = 0
+        self._focus: Optional[Adapter] = None
+        self._render_id = None
+        self._rendering = False
+        self._predicate: Optional[Callable[[Adapter], bool]] = None
+        self._pending: 'deque[Adapter]' = deque()
+        self._insert_id = None
+        self._sort_order: List[Tuple[int, bool]] = []
+        self.search_index = SearchIndex()
+        # Optional lookup of more matching keys, like a full text index
+        self.fulltext: Optional[Callable[[str], Set[str]]] = None
+        self._query = ''
+        self._matches: Optional[Set[str]] = None
+        # Rows of new content are indexed in time slices, until then searches check them one by one
+        self._unindexed: Dict[str, Adapter] = {}
+        self._index_id = None
+
         super().__init__(master, columns=adapter.headings, show='headings', **kwargs)
         self.adapter_class = adapter
 
         self.font = 'helvetica 10'
+        self.rowheight = font.Font(font=self.font).metrics('linespace') + 5
         self.style = ttk.Style()
         self.style.configure('Treeview', 
                 font=self.font,
-                rowheight=font.Font(font=self.font).metrics('linespace') + 5)
+                rowheight=self.rowheight)
         self.style.configure('Treeview.Heading', 
                 font=self.font,
                 rowheight=font.Font(font=self.font).metrics('linespace') + 20)
         self.style.configure('Scaling.Treeview',  
-                rowheight=font.Font(font=self.font).metrics('linespace') + 5)
+                rowheight=self.rowheight)
 
         self.style.map('Treeview', foreground=self.fixed_map('foreground'), background=self.fixed_map('background'))
 
@@ -102,6 +209,9 @@ class ItemTreeview(ttk.Treeview):
 
         self._content: Dict[str, Adapter] = {}
         self._item_content: Dict[str, Adapter] = {}
+
+        if self.virtual:
+            self.bind('<Configure>', lambda _: self._render(self._first_visible()), add='+')
     
     def fixed_map(self, option):
         """
@@ -122,30 +232,112 @@ class ItemTreeview(ttk.Treeview):
 
     @content.setter
     def content(self, objects):
+        """ Show objects, touching only the rows that were added, removed or changed.
+            New rows are added to the end in time slices, and the scroll position and
+            focus of the rows that remain are kept. Added and changed rows are indexed
+            for search in time slices as well.
+        """
+        old = self._content
         self._content = {}
+        added, changed = [], []
 
         for o in objects:
-            adapter = self.create_adapter(o)
-            self._content[adapter.key()] = adapter
-
-        self.build_tree()
+            key = self.adapter_class.generate_key(o)
+            adapter = old.pop(key, None)
+            if adapter is None:
+                adapter = self.create_adapter(o)
+                added.append(adapter)
+            elif adapter.item is not o:
+                adapter.item = o
+                changed.append(adapter)
+            self._content[key] = adapter
+
+        removed = list(old.values())
+        for key in old:
+            self._unindex(key)
+        for adapter in added + changed:
+            self._unindexed[adapter.key()] = adapter
+        if self._unindexed and self._index_id is None:
+            self._index_id = self.after_idle(self._index_pending)
+
+        if self.virtual:
+            self._apply_virtual_diff(added, removed, changed)
+        else:
+            self._apply_diff(added, removed, changed)
     
     @property
     def selected_text(self):
+        if self.virtual:
+            adapter = self.selected
+            return adapter.text() if adapter is not None else ''
         return self.item(self.focus())['text']
     
     @property
     def selected(self):
-        return self._item_content.get(self.focus(), None)
+        if not self.virtual:
+            return self._item_content.get(self.focus(), None)
+
+        # Recycled items are deselected, so any selection in the widget is current
+        selection = self.selection()
+        if selection:
+            focus = self.focus()
+            iid = focus if focus in selection else selection[0]
+            self._focus = self._item_content.get(iid, self._focus)
+        return self._focus
     
     def create_adapter(self, object) -> Adapter:
         return self.adapter_class(object)
 
+    def rows(self) -> List[Adapter]:
+        """ Adapters in display order """
+        if self.virtual:
+            return self._rows
+        return [self._item_content[iid] for iid in self.get_children()]
+
+    def neighbours(self, count: int = 1) -> List[Adapter]:
+        """ Adapters of the rows around the focused row in display order, nearest first
+            and the next row before the previous one.
+        """
+        rows = self.rows()
+        focus = self.selected
+        if focus is None or focus not in rows:
+            return []
+
+        pos = self._position(focus)
+        adapters = []
+        for offset in range(1, count + 1):
+            for i in (pos + offset, pos - offset):
+                if 0 <= i < len(rows):
+                    adapters.append(rows[i])
+        return adapters
+
+    def visible_items(self) -> List[Adapter]:
+        """ Adapters of the rows currently scrolled into view, top to bottom """
+        if self.virtual:
+            first = self._first_visible()
+            return self._rows[first:first + self._page_size()]
+
+        children = self.get_children()
+        top, bottom = self.yview()
+        first = int(top * len(children))
+        last = math.ceil(bottom * len(children))
+        return [self._item_content[iid] for iid in children[first:last]]
+
     def focus_to_position(self, pos=-1):
         """ Move focus to item in position if possible """
         # Focus on view incase application is focused elsewhere
         self.focus_set()
 
+        if self.virtual:
+            if -1 < pos < len(self._rows):
+                self._select(self._rows[pos])
+            elif pos >= len(self._rows) and self._rows:
+                self._select(self._rows[-1])
+            else:
+                self._focus = None
+                self.selection_set()
+            return
+
         children = self.get_children()
         if -1 < pos < len(children):
             self.focus(children[pos])
@@ -157,49 +349,174 @@ class ItemTreeview(ttk.Treeview):
             self.focus_set()
             self.selection_set()
 
-    def update_object(self, object: Any):
-        object_adapter = self.create_adapter(object)
-        key = object_adapter.key()
+    def _apply_diff(self, added: List[Adapter], removed: List[Adapter], changed: List[Adapter]):
+        children = self.get_children()
+        top, _ = self.yview()
+        anchor = self._item_content[children[int(top * len(children))]] if children else None
+
+        shown = [a for a in removed if a.iid is not None]
+        if shown:
+            first = min(self.index(a.iid) for a in shown)
+            self.delete(*[a.iid for a in shown])
+            for a in shown:
+                del self._item_content[a.iid]
+                a.iid = None
+
+            # Rows below the removed ones may have changed between odd and even
+            for index, iid in enumerate(self.get_children()[first:], first):
+                self.item(iid, tags=self._item_content[iid].tag(index))
+
+        for adapter in changed:
+            if adapter.iid is not None:
+                self.item(adapter.iid, values=adapter.values(), tag=adapter.tag(self.index(adapter.iid)))
+
+        removed_ids = {id(a) for a in removed}
+        self._pending = deque(a for a in self._pending if id(a) not in removed_ids)
+        self._pending.extend(added)
+
+        if anchor is not None and anchor.iid is not None:
+            children = self.get_children()
+            self.yview_moveto(children.index(anchor.iid) / len(children))
+
+        if self._pending and self._insert_id is None:
+            self._insert_id = self.after_idle(self._insert_pending)
+
+    def _insert_pending(self):
+        """ Insert pending rows until the time slice is used, then yield to the event loop """
+        self._insert_id = None
+        deadline = time.perf_counter() + self.INSERT_SLICE
+
+        while self._pending and time.perf_counter() < deadline:
+            self.create_item(self._pending.popleft(), len(self._item_content))
+
+        if self._pending:
+            self._insert_id = self.after(1, self._insert_pending)
+
+    def _index_pending(self):
+        """ Index rows until the time slice is used, then yield to the event loop """
+        self._index_id = None
+        deadline = time.perf_counter() + self.INSERT_SLICE
+
+        while self._unindexed and time.perf_counter() < deadline:
+            self._index(next(iter(self._unindexed.values())))
+
+        if self._unindexed:
+            self._index_id = self.after(1, self._index_pending)
+
+    def _apply_virtual_diff(self, added: List[Adapter], removed: List[Adapter], changed: List[Adapter]):
+        removed_ids = {id(a) for a in removed}
+
+        # Keep the top row in place, or the first row below it that remains
+        first = self._first_visible()
+        anchor = next((a for a in self._rows[first:] if id(a) not in removed_ids), None)
+        selection = set(self.selection()).intersection(a.iid for a in removed)
+        if selection:
+            self.selection_remove(*selection)
+        if self._focus is not None and id(self._focus) in removed_ids:
+            self._focus = None
+
+        self._rows = [a for a in self._rows if id(a) not in removed_ids]
+        self._insert_rows(added)
+
+        if anchor is not None:
+            first = self._rows.index(anchor)
+        self._render(first, refresh=bool(changed or removed))
+
+    def update_object(self, object: Any, select: bool = True):
+        key = self.adapter_class.generate_key(object)
 
         if key in self.content:
             adapter = self.content[key]
 
             if object is None:
-                self.delete(adapter.iid)
-                del self._item_content[adapter.iid]
-                del self.content[key]
+                self.delete_object(adapter.item)
             else:
-                adapter.object = object
-                index = self.index(adapter.iid)
-                self.item(adapter.iid, values=adapter.values(), tag=adapter.tag(index))
+                adapter.item = object
+                self._index(adapter)
+                if adapter.iid is not None:
+                    index = self._position(adapter)
+                    self.item(adapter.iid, values=adapter.values(), tag=adapter.tag(index))
         else:
             if object is not None:
                 adapter = self.create_adapter(object)
-                self.create_item(adapter, index=len(self.content))
-
                 self._content[key] = adapter
+                self._index(adapter)
+
+                if self.virtual:
+                    shown = self._insert_rows([adapter])
+                    if select and shown:
+                        self._select(adapter)
+                    else:
+                        self._schedule_render()
+                    return
 
-                self.focus(adapter.iid)
-                self.selection_set(adapter.iid)
+                self.create_item(adapter, index=len(self.content) - 1)
+
+                if select:
+                    self.focus(adapter.iid)
+                    self.selection_set(adapter.iid)
+
+    def update_objects(self, objects: Iterable[Any]):
+        """ Refresh the rows of several objects without changing the selection """
+        for o in objects:
+            self.update_object(o, select=False)
 
     def delete_object(self, object: Any):
-        key = self.adapter_class.generate_key(object)
-        if key in self.content:
-            adapter = self._content[key]
-            
-            self.delete(adapter.iid)
+        self.delete_objects([object])
+
+    def delete_objects(self, objects: Iterable[Any]):
+        """ Remove the rows of several objects, in one pass over the rows in virtual mode """
+        removed = []
+        for o in objects:
+            key = self.adapter_class.generate_key(o)
+            if key in self.content:
+                removed.append(self._content.pop(key))
+                self._unindex(key)
+
+        if not removed:
+            return
+
+        if self.virtual:
+            removed_ids = {id(a) for a in removed}
+            self._rows = [a for a in self._rows if id(a) not in removed_ids]
+            if self._focus is not None and id(self._focus) in removed_ids:
+                self._focus = None
+            self._schedule_render()
+            return
+
+        for adapter in removed:
+            if adapter.iid is None:
+                # Not inserted yet
+                self._pending.remove(adapter)
+                continue
 
-            del self._content[key]
+            self.delete(adapter.iid)
             del self._item_content[adapter.iid]
 
     def build_tree(self):
         self.clear_tree()
 
+        if self.virtual:
+            self._rows = list(self.content.values())
+            self._render(0)
+            return
+
         for i, adapter in enumerate(self.content.values()):
             self.create_item(adapter, i)
 
     def clear_tree(self):
+        if self._insert_id is not None:
+            self.after_cancel(self._insert_id)
+            self._insert_id = None
+        self._pending.clear()
+
+        for adapter in self._item_content.values():
+            adapter.iid = None
         self._item_content = {}
+        self._rows = []
+        self._window = []
+        self._start = 0
+        self._focus = None
         self.delete(*self.get_children())
 
     def create_item(self, adapter, index):
@@ -214,28 +531,304 @@ class ItemTreeview(ttk.Treeview):
         self._item_content[adapter.iid] = adapter
 
     def on_sort(self, heading: str = None, reverse: bool = True):
-        # Create list with a tuple of value at selected column and itemid
+        """ Sort by heading, with the previously sorted columns breaking ties """
         if heading is None:
             heading = self.adapter_class.headings[0]
             reverse = False
-          
-        l = [(self.set(iid, heading), iid) for iid in self.get_children()]
 
-        # Try to sort as numbers
-        try:
-            l.sort(key=lambda t: float(str(t[0]).replace(' ','').replace(',','.')), reverse=reverse)
-        except ValueError:
-            l.sort(key=lambda t: str(t[0]), reverse=reverse)
+        column = self.adapter_class.headings.index(heading)
+        self._sort_order = [(column, reverse)] + [(c, r) for c, r in self._sort_order if c != column]
+        self._sort_order = self._sort_order[:self.SORT_DEPTH]
 
-        # Move items based on itemid
-        for index, (_, iid) in enumerate(l):
-            adapter = self._item_content[iid]
-            self.item(iid, tags=adapter.tag(index))
-            self.move(iid, '', index)
+        rows = self._sorted(self.rows())
+
+        if self.virtual:
+            self._rows = rows
+            self._render(self._first_visible(), refresh=True)
+        else:
+            self._reorder(rows)
 
         # Reverse sorting function
         self.heading(heading, command=lambda h=heading: self.on_sort(h, not reverse))
 
+    def _insert_rows(self, adapters: List[Adapter]) -> bool:
+        """ Add rows that pass the predicate of the shown search at their sorted
+            position in virtual mode. Returns False if none of them are shown.
+        """
+        if self._predicate is not None:
+            adapters = [a for a in adapters if self._predicate(a)]
+
+        if not self._sort_order:
+            self._rows.extend(adapters)
+        elif len(adapters) > self.SORTED_INSERT_LIMIT:
+            self._rows = self._sorted(self._rows + adapters)
+        else:
+            for adapter in adapters:
+                self._rows.insert(self._insert_position(adapter), adapter)
+        return bool(adapters)
+
+    def _insert_position(self, adapter: Adapter) -> int:
+        """ Index in the rows after every row that sorts before or equal to adapter """
+        low, high = 0, len(self._rows)
+        while low < high:
+            middle = (low + high) // 2
+            if self._sorts_before(adapter, self._rows[middle]):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _sorts_before(self, a: Adapter, b: Adapter) -> bool:
+        for column, reverse in self._sort_order:
+            key_a, key_b = a.sort_key(column), b.sort_key(column)
+            if key_a != key_b:
+                return key_a > key_b if reverse else key_a < key_b
+        return False
+
+    def _sorted(self, rows: Iterable[Adapter]) -> List[Adapter]:
+        rows = list(rows)
+        # Sorting is stable, so sorting by the least significant column first gives the full order
+        for c, r in reversed(self._sort_order):
+            rows.sort(key=lambda adapter: adapter.sort_key(c), reverse=r)
+        return rows
+
+    def _reorder(self, rows: List[Adapter]):
+        """ Put the items in the order of rows, moving as few items as possible """
+        position = {adapter.iid: i for i, adapter in enumerate(self.rows())}
+        keep = longest_increasing([position[adapter.iid] for adapter in rows])
+
+        for index, adapter in enumerate(rows):
+            old_index = position[adapter.iid]
+            if index not in keep:
+                # Detach first so the index of the previous row is where it ends up
+                self.detach(adapter.iid)
+                self.move(adapter.iid, '', self.index(rows[index - 1].iid) + 1 if index else 0)
+
+            tag = adapter.tag(index)
+            if tag != adapter.tag(old_index):
+                self.item(adapter.iid, tags=tag)
+
+    def filter(self, predicate: Callable[[Adapter], bool]):
+        """ Show only the adapters that match predicate, in virtual mode """
+        self._predicate = predicate
+        self._rows = self._sorted(adapter for adapter in self.content.values() if predicate(adapter))
+        self._render(0, refresh=True)
+
+    def search(self, query: str):
+        """ Show the rows that contain query in their searched columns, in virtual mode.
+
+            A query that contains the previous one can only match rows that matched
+            before, so only those are checked.
+        """
+        query = query.lower()
+        narrow = self._matches is not None and self.narrows(self._query, query)
+        if not query:
+            matches = None
+        else:
+            matches = self.find(query, self._matches if narrow else None)
+            matches |= {key for key, adapter in self._unindexed.items() if self.accepts(query, adapter)}
+
+        if matches is None:
+            self._predicate = None
+            self._rows = self._sorted(self.content.values())
+        else:
+            self._predicate = lambda adapter: self.accepts(query, adapter)
+            if narrow:
+                self._rows = [adapter for adapter in self._rows if adapter.key() in matches]
+            else:
+                # Only the matches are sorted, so a narrow filter stays cheap on a long list
+                content = self._content
+                self._rows = self._sorted(content[key] for key in matches if key in content)
+
+        self._query, self._matches = query, matches
+        self._render(0, refresh=True)
+
+    def find(self, query: str, within: Optional[Set[str]] = None) -> Set[str]:
+        """ Keys of the rows that match query, only looking at `within` if given """
+        matches = self.search_index.search(query, within)
+        if self.fulltext is not None:
+            matches |= self.fulltext(query)
+        return matches
+
+    def accepts(self, query: str, adapter: Adapter) -> bool:
+        """ Check a row added while a search is shown """
+        return query in self.search_text(adapter)
+
+    def narrows(self, previous: str, query: str) -> bool:
+        """ True if query can only match rows that previous matched """
+        if self.fulltext is not None:
+            # Full text hits match the start of words, "bc" doesn't find the rows "abc" does
+            return query.startswith(previous)
+        return previous in query
+
+    def search_text(self, adapter: Adapter) -> str:
+        values = adapter.values()[:self._num_search_values]
+        return ', '.join(str(v).lower() for v in values)
+
+    def _index(self, adapter: Adapter):
+        self._unindexed.pop(adapter.key(), None)
+        # Earlier results can't be narrowed once a row may have started to match
+        if self.search_index.update(adapter.key(), self.search_text(adapter)):
+            self._matches = None
+
+    def _unindex(self, key: str):
+        self._unindexed.pop(key, None)
+        self.search_index.remove(key)
+
+    def yview(self, *args):
+        """ In virtual mode the view is reported and moved in rows of the whole list """
+        if not self.virtual:
+            return super().yview(*args)
+
+        total = len(self._rows)
+        if not args:
+            if not self._window or not total:
+                return (0.0, 1.0)
+            top, bottom = super().yview()
+            first = self._start + top * len(self._window)
+            last = self._start + bottom * len(self._window)
+            return (first / total, min(last / total, 1.0))
+
+        if args[0] == 'moveto':
+            first = int(float(args[1]) * total)
+        else:
+            step = self._page_size() if args[2].startswith('page') else 1
+            first = self._first_visible() + int(args[1]) * step
+        self._render(first)
+
+    def on_scroll(self):
+        """ Move the window of items when the view has been scrolled close to its edge """
+        if not self.virtual or not self._window or self._rendering:
+            return
+
+        offset = self._first_visible() - self._start
+        margin = self._page_size()
+        near_top = offset < margin // 2 and self._start > 0
+        near_bottom = offset + 2 * margin > len(self._window) and self._start + len(self._window) < len(self._rows)
+        if near_top or near_bottom:
+            self._render(self._start + offset)
+
+    def _page_size(self) -> int:
+        return max(1, self.winfo_height() // self.rowheight)
+
+    def _first_visible(self) -> int:
+        if not self._window:
+            return 0
+        top, _ = super().yview()
+        return self._start + round(top * len(self._window))
+
+    def _position(self, adapter: Adapter) -> int:
+        if self.virtual and adapter.iid is not None:
+            return self._start + self._window.index(adapter.iid)
+        if self.virtual:
+            return self._rows.index(adapter)
+        return self.index(adapter.iid)
+
+    def _select(self, adapter: Adapter):
+        """ Scroll adapter into view and make it the focused and selected row """
+        self._focus = adapter
+        pos = self._position(adapter)
+        first = self._first_visible()
+        if not first <= pos < first + self._page_size():
+            first = pos - self._page_size() // 2
+        self._render(first, focus=adapter)
+
+        super().focus(adapter.iid)
+        self.selection_set(adapter.iid)
+
+    def _schedule_render(self):
+        if self._render_id is None:
+            self._render_id = self.after_idle(lambda: self._render(self._first_visible(), refresh=True))
+
+    def _render(self, first: int, refresh: bool = False, focus: Optional[Adapter] = None):
+        """ Fill the window with the rows around first, and scroll first to the top.
+
+            Items for rows that stay in the window are kept, so they keep their
+            selection. The other items are recycled for the rows that came into view.
+        """
+        if self._render_id is not None:
+            self.after_cancel(self._render_id)
+            self._render_id = None
+
+        # Pick up a row the user selected before its item is recycled
+        if focus is None:
+            focus = self.selected
+        selection = set(self.selection())
+
+        page = self._page_size()
+        total = len(self._rows)
+        first = max(0, min(first, total - page))
+        start = max(0, min(first - page, total - 3 * page))
+        rows = self._rows[start:start + 3 * page]
+
+        keep = {adapter.iid for adapter in rows if adapter.iid is not None}
+        free = [iid for iid in self._window if iid not in keep]
+        for iid in free:
+            self._item_content.pop(iid).iid = None
+        if selection.intersection(free):
+            self.selection_remove(*selection.intersection(free))
+
+        window = []
+        for i, adapter in enumerate(rows):
+            if adapter.iid is None:
+                iid = free.pop() if free else self.insert('', 'end')
+                adapter.iid = iid
+                self._item_content[iid] = adapter
+                self.item(iid, text=adapter.text(), values=adapter.values(), tags=adapter.tag(start + i))
+            elif refresh:
+                self.item(adapter.iid, values=adapter.values(), tags=adapter.tag(start + i))
+            window.append(adapter.iid)
+
+        if free:
+            self.delete(*free)
+        if window != self._window:
+            for i, iid in enumerate(window):
+                self.move(iid, '', i)
+
+        self._window = window
+        self._start = start
+
+        if focus is not None and focus.iid is not None and focus.iid not in selection:
+            super().focus(focus.iid)
+            self.selection_set(focus.iid)
+
+        self._rendering = True
+        try:
+            super().yview_moveto(0)
+            super().yview_scroll(first - start, 'units')
+            self._update_scrollbar()
+        finally:
+            self._rendering = False
+
+    def _update_scrollbar(self):
+        command = self.cget('yscrollcommand')
+        if command:
+            self.tk.call(command, *self.yview())
+
+
+
+def longest_increasing(sequence: List[int]) -> set:
+    """ Indices of a longest strictly increasing subsequence """
+    tails: List[int] = []
+    tail_indices: List[int] = []
+    previous = [-1] * len(sequence)
+
+    for i, value in enumerate(sequence):
+        k = bisect.bisect_left(tails, value)
+        if k == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[k] = value
+            tail_indices[k] = i
+        previous[i] = tail_indices[k - 1] if k else -1
+
+    indices = set()
+    i = tail_indices[-1] if tail_indices else -1
+    while i != -1:
+        indices.add(i)
+        i = previous[i]
+    return indices
 
 
 class SearchableTree(ttk.Treeview):
@@ -270,10 +863,53 @@ class SearchableTree(ttk.Treeview):
         self.event_generate('<<TreeviewSearched>>')
 
 class DocumentInfoTree(ItemTreeview, SearchableTree, ScrollbarTreeview):
+    """ Document list where searches may filter on fields, see document_query """
     def __init__(self, master, **kwargs):
-        super().__init__(master=master, adapter=DocumentInfoAdapter)
+        self.field_index = document_query.DocumentIndex()
+        super().__init__(master=master, adapter=DocumentInfoAdapter, virtual=True)
         self._num_search_values = 3
 
         self.tag_configure('pending', background='gold', foreground='yellow')
         self.tag_configure('moved', background='lightgreen', foreground='grey23')
+        self.tag_configure('duplicate', background='lightgrey', foreground='red3')
+
+    def searcher(self, query: str):
+        if not self.virtual:
+            return super().searcher(query)
+
+        self.search(query)
+        self.event_generate('<<TreeviewSearched>>')
+
+    def find(self, query, within=None):
+        parsed = document_query.parse_query(query)
+        if not parsed.filters:
+            return super().find(query, within)
+
+        matches = self.field_index.evaluate(parsed.filters)
+        if parsed.text:
+            matches &= super().find(parsed.text.lower())
+        return matches
+
+    def accepts(self, query, adapter):
+        parsed = document_query.parse_query(query)
+        return document_query.matches(parsed, adapter.item) and super().accepts(parsed.text.lower(), adapter)
+
+    def narrows(self, previous, query):
+        # Field values are looked up whole, so a longer value is not narrower
+        if document_query.parse_query(query).filters:
+            return False
+        return super().narrows(previous, query)
+
+    def _index(self, adapter):
+        super()._index(adapter)
+        if self.field_index.update(adapter.key(), adapter.item):
+            self._matches = None
+
+    def _unindex(self, key):
+        super()._unindex(key)
+        self.field_index.remove(key)
+
+    def on_scroll(self):
+        super().on_scroll()
+        self.event_generate('<<TreeviewScrolled>>')
 
@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from hashing import file_checksum
+from transfer import TransferJob
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UnfinishedBatch:
+    """ A batch found in the journal that was never ended """
+    batch_id: str
+    header: Dict[str, Any]
+    jobs: List[TransferJob] = field(default_factory=list)
+    done: List[TransferJob] = field(default_factory=list)
+
+    @property
+    def remaining(self) -> List[TransferJob]:
+        done = {j.index for j in self.done}
+        return [j for j in self.jobs if j.index not in done]
+
+
+class TransferJournal:
+    """ Write-ahead journal for batch transfers.
+
+        The planned jobs of a batch are written and fsynced before any file is
+        transferred. Finished transfers are appended as they are confirmed, but only
+        fsynced once `group_size` records or `group_delay` seconds have accumulated.
+        When a batch ends the journal is compacted down to the last header.
+    """
+    def __init__(self, journal_file: Path, group_size: int = 64, group_delay: float = 1.0):
+        self.journal_file = journal_file
+        self.group_size = group_size
+        self.group_delay = group_delay
+
+        self._batch_id: Optional[str] = None
+        self._stream = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def begin(self, jobs: List[TransferJob], header: Optional[Dict[str, Any]] = None) -> str:
+        """ Write the plan for a new batch and make it durable """
+        with self._lock:
+            self._batch_id = uuid.uuid4().hex
+            self._open()
+            self._write({'batch': self._batch_id, 'header': header or {}})
+            for job in jobs:
+                self._write({
+                    'plan': job.index,
+                    'source': str(job.source),
+                    'target': str(job.target),
+                    'size': job.size,
+                    'checksum': job.checksum,
+                    'move': job.move,
+                })
+            self._sync()
+            return self._batch_id
+
+    def resume(self, batch: UnfinishedBatch) -> None:
+        """ Continue appending confirmations to an unfinished batch """
+        with self._lock:
+            self._batch_id = batch.batch_id
+            self._open()
+
+    def confirm(self, job: TransferJob) -> None:
+        """ Record a finished transfer, fsyncing in groups """
+        with self._lock:
+            self._write({'done': job.index})
+            self._unsynced += 1
+            if self._unsynced >= self.group_size or time.monotonic() - self._last_sync >= self.group_delay:
+                self._sync()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._stream is not None:
+                self._sync()
+
+    def end(self, header: Optional[Dict[str, Any]] = None) -> None:
+        """ Mark the batch as complete and compact the journal """
+        with self._lock:
+            self._close()
+            self._batch_id = None
+
+            tmp = self.journal_file.with_suffix(self.journal_file.suffix + '.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'batch': None, 'header': header or {}}) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.journal_file)
+
+    def last_header(self) -> Dict[str, Any]:
+        """ Header of the last batch in the journal, finished or not """
+        header = {}
+        for record in self._records():
+            if 'batch' in record:
+                header = record['header']
+        return header
+
+    def unfinished(self) -> Optional[UnfinishedBatch]:
+        """ Return the batch that was interrupted, if any """
+        batch = None
+        planned: Dict[int, TransferJob] = {}
+
+        for record in self._records():
+            if 'batch' in record:
+                batch = UnfinishedBatch(record['batch'], record['header']) if record['batch'] else None
+                planned = {}
+            elif batch is None:
+                continue
+            elif 'plan' in record:
+                job = TransferJob(
+                    source=Path(record['source']),
+                    target=Path(record['target']),
+                    size=record['size'],
+                    move=record['move'],
+                    checksum=record['checksum'],
+                    index=record['plan'],
+                )
+                planned[job.index] = job
+                batch.jobs.append(job)
+            elif 'done' in record and record['done'] in planned:
+                batch.done.append(planned[record['done']])
+
+        if batch is not None:
+            self._verify_remaining(batch)
+        return batch
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _verify_remaining(self, batch: UnfinishedBatch) -> None:
+        """ Jobs that finished after the last fsync are found on disk and need no copy """
+        for job in batch.remaining:
+            if is_transferred(job):
+                batch.done.append(job)
+                if job.move and job.source.exists():
+                    # The copy is verified, only the removal of the source was lost
+                    os.remove(job.source)
+
+    def _records(self):
+        try:
+            f = open(self.journal_file, encoding='utf-8')
+        except FileNotFoundError:
+            return
+
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn write at the end of the journal
+                    logger.warning(f'Skipping damaged journal record in {self.journal_file}')
+
+    def _open(self) -> None:
+        if self._stream is None:
+            self._stream = open(self.journal_file, 'a', encoding='utf-8')
+
+    def _close(self) -> None:
+        if self._stream is not None:
+            self._sync()
+            self._stream.close()
+            self._stream = None
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self._stream.write(json.dumps(record) + '\n')
+
+    def _sync(self) -> None:
+        self._stream.flush()
+        os.fsync(self._stream.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+
+def is_transferred(job: TransferJob) -> bool:
+    """ Check if the target already holds the complete source content """
+    try:
+        target_size = job.target.stat().st_size
+    except OSError:
+        return False
+
+    if target_size != job.size:
+        return False
+
+    if job.checksum is not None:
+        try:
+            return file_checksum(job.target) == job.checksum
+        except OSError:
+            return False
+
+    # Renames are atomic, the target only exists once it is complete
+    return job.move and not job.source.exists()
@@ -0,0 +1,129 @@
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+
+import pdf_reader
+from fulltext_index import FullTextIndex
+from scan_index import ScanEntry
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataExtractor(threading.Thread):
+    """ Read the header and text of documents on a process pool.
+
+        Each file is read once, and the pass fills both the metadata cache and the
+        full text index. Entries are read in the order they are submitted, except
+        for the ones passed to prioritize(), which go first. Only a few files per
+        worker are handed to the pool at a time, so prioritizing stays effective.
+        Results are put on `results` as ParseResult, without the text.
+    """
+    def __init__(self, cache: Optional[pdf_reader.MetadataCache] = None, backend: Optional[pdf_reader.ExtractionBackend] = None, index: Optional[FullTextIndex] = None, max_workers: Optional[int] = None):
+        super().__init__(name='MetadataExtractor', daemon=True)
+        self.cache = cache if cache is not None else pdf_reader.MetadataCache()
+        self.backend = backend
+        self.index = index
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+        self.results: 'queue.Queue[pdf_reader.ParseResult]' = queue.Queue()
+
+        self._pending: 'OrderedDict[Path, ScanEntry]' = OrderedDict()
+        self._running: Dict[Future, ScanEntry] = {}
+        self._in_flight: Set[Path] = set()
+        self._discarded: Set[Path] = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def submit(self, entries: Iterable[ScanEntry]) -> None:
+        """ Queue files for reading, a newer entry for a queued path replaces the old one """
+        with self._condition:
+            for entry in entries:
+                self._pending[entry.path] = entry
+                self._discarded.discard(entry.path)
+            self._condition.notify()
+
+    def prioritize(self, paths: Iterable[Path]) -> None:
+        """ Move queued paths to the front, keeping their order """
+        with self._condition:
+            for path in reversed(list(paths)):
+                if path in self._pending:
+                    self._pending.move_to_end(path, last=False)
+
+    def discard(self, paths: Iterable[Path]) -> None:
+        """ Drop queued paths, results for paths being read are thrown away """
+        with self._condition:
+            for path in paths:
+                self._pending.pop(path, None)
+                if path in self._in_flight:
+                    self._discarded.add(path)
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._pending.clear()
+            self._condition.notify()
+
+    def run(self) -> None:
+        executor = ProcessPoolExecutor(self.max_workers)
+        try:
+            while True:
+                entry = self._next_entry()
+                if self._stopped:
+                    return
+                if entry is not None:
+                    if not self._report_cached(entry):
+                        self._running[executor.submit(pdf_reader.read_document, str(entry.path), self.backend)] = entry
+                    continue
+
+                done, _ = wait(list(self._running), timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    entry = self._running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = pdf_reader.ParseResult(str(entry.path), error=f'{e.__class__.__qualname__}: {e}')
+                    self._finish(entry, result)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _next_entry(self) -> Optional[ScanEntry]:
+        """ The next entry to read, or None while the pool is busy or nothing is running """
+        with self._condition:
+            while not self._pending and not self._running and not self._stopped:
+                self._condition.wait()
+            if self._stopped or not self._pending or len(self._running) >= 2 * self.max_workers:
+                return None
+            _, entry = self._pending.popitem(last=False)
+            self._in_flight.add(entry.path)
+            return entry
+
+    def _report_cached(self, entry: ScanEntry) -> bool:
+        """ Report a cached result if the file doesn't have to be read for the index either """
+        link = str(entry.path)
+        info = self.cache.get(link, entry.mtime)
+        if info is None or (self.index is not None and self.index.mtime(entry.path) != entry.mtime):
+            return False
+        self._finish(entry, pdf_reader.ParseResult(link, info=info), cached=True)
+        return True
+
+    def _finish(self, entry: ScanEntry, result: pdf_reader.ParseResult, cached: bool = False) -> None:
+        with self._condition:
+            self._in_flight.discard(entry.path)
+            if entry.path in self._discarded:
+                self._discarded.discard(entry.path)
+                return
+
+        if result.info is None:
+            logger.debug(f'Could not parse {result.link}: {result.error}')
+        elif not cached:
+            self.cache.put(result.link, entry.mtime, result.info)
+
+        if self.index is not None and result.text is not None:
+            self.index.add(entry.path, entry.mtime, result.text)
+        result.text = None
+        self.results.put(result)
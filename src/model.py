@@ -1,7 +1,14 @@
+import collections
 import enum
+import errno
+import logging
+import threading
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
 
 
 class Status(enum.Enum):
@@ -14,22 +21,89 @@ class NumberSeries:
         self.prefix = prefix
         self.number = number
         self.current_number = self.number
+        # Shared NumberAllocator, None when the series is only used on this station
+        self.allocator = None
+        self._reserved = collections.deque()
+        # Numbers up to this one are in use here and must not be reserved
+        self._floor = 0
+        self._reserving: Optional[threading.Thread] = None
+
+    def attach(self, allocator) -> None:
+        """ Take numbers from a shared allocator, past the numbers already used here.
+            Numbers are reserved in the background, so the share is never waited on.
+        """
+        self.allocator = allocator
+        self._floor = self.current_number
+        self._reserve_more()
     
     def restart_series(self, number):
-        """ Restart the series from the given number. """
+        """ Restart the series from the given number, keeping numbers already handed out. """
         self.number = number
-        self.current_number = self.number
+        self.current_number = max(self.current_number, number)
+        self._floor = max(self._floor, number)
 
     def next(self) -> str:
-        """ Returns the next filenumber in the series. """
-        self.current_number += 1
-        return f'{self.prefix}{self.current_number}'
+        """ Returns the next filenumber in the series. Raises OSError when the series is
+            shared and no numbers could be reserved yet.
+        """
+        if self.allocator is None:
+            self.current_number += 1
+            return f'{self.prefix}{self.current_number}'
+
+        if not self._reserved:
+            self._reserve_more()
+            raise OSError(errno.EAGAIN, f'No numbers reserved for {self.prefix} yet')
+
+        number = self._reserved.popleft()
+        self.current_number = max(self.current_number, number)
+        if len(self._reserved) < self.allocator.block_size // 2:
+            self._reserve_more()
+        return f'{self.prefix}{number}'
     
     def save(self) -> None:
         self.number = self.current_number
     
     def reset(self) -> None:
+        """ Forget the numbers handed out since the last save. A shared series only gives
+            back its unused reservation, numbers taken from the share may already name
+            registered documents.
+        """
+        if self.allocator is not None:
+            self.release()
+            return
         self.current_number = self.number
+
+    def release(self, timeout: float = 5.0) -> None:
+        """ Give reserved numbers that were not handed out back to the allocator.
+            A reservation in progress is waited for up to timeout seconds first.
+        """
+        if self.allocator is None:
+            return
+        if self._reserving is not None and self._reserving.is_alive():
+            self._reserving.join(timeout)
+        numbers = []
+        while self._reserved:
+            numbers.append(self._reserved.popleft())
+        try:
+            self.allocator.release(self.prefix, numbers)
+        except OSError as e:
+            logger.warning(f'Could not give back numbers {numbers} for {self.prefix}: {e}')
+
+    def _reserve_more(self) -> None:
+        if self._reserving is None or not self._reserving.is_alive():
+            self._reserving = threading.Thread(target=self._reserve, name=f'Reserve {self.prefix}', daemon=True)
+            self._reserving.start()
+
+    def _reserve(self) -> None:
+        floor = self._floor
+        try:
+            numbers = self.allocator.reserve(self.prefix, floor=floor)
+        except OSError as e:
+            logger.warning(f'Could not reserve numbers for {self.prefix}: {e}')
+            return
+        if self._floor == floor:
+            self._floor = 0
+        self._reserved.extend(numbers)
     
     def __str__(self) -> str:
         return f'<{self.__class__.__qualname__}({self.prefix!r}, {self.number!r})>'
@@ -51,8 +125,21 @@ class DocumentInfo:
         self.name = self.link.name
         self.date = datetime.now()
         self.dst_folder = None
+        self.moved_to = None
+        self.checksum = None
+        self.duplicate_of = None
+        self.metadata = None
         self.status = Status.OK
     
     @property
     def is_pending(self) -> bool:
         return self.status == Status.PENDING
+
+    @property
+    def is_duplicate(self) -> bool:
+        return self.duplicate_of is not None
+
+    @property
+    def location(self) -> Path:
+        """ Current location of the file, which is the destination once it has been moved """
+        return self.moved_to if self.moved_to is not None else self.link
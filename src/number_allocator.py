@@ -0,0 +1,132 @@
+import json
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class NumberAllocator:
+    """ Reserve blocks of numbers from a file shared by several stations.
+
+        The file holds the next free number of every series and the numbers that
+        were reserved and given back. A lock file next to it serializes the
+        stations, and each reservation is one lock, read and write, so numbers
+        within a block are handed out without touching the share.
+
+        The lock file holds a token unique to the holder, which is checked before
+        the state is written and before the lock is removed. A lock is taken to be
+        left behind by a crashed station when it is older than `stale_after`
+        seconds by the clock of the file server.
+    """
+    def __init__(self, shared_file: Path, block_size: int = 20, timeout: float = 10.0, stale_after: float = 30.0):
+        self.shared_file = shared_file
+        self.lock_file = shared_file.with_suffix(shared_file.suffix + '.lock')
+        self.clock_file = shared_file.with_suffix(f'{shared_file.suffix}.{socket.gethostname()}.clock')
+        self.block_size = block_size
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.station = socket.gethostname()
+
+    def reserve(self, prefix: str, count: Optional[int] = None, floor: int = 0) -> List[int]:
+        """ Reserve count numbers above floor, returned numbers are used before new ones """
+        count = count if count is not None else self.block_size
+        with self._locked() as state:
+            series = state.setdefault(prefix, {'next': 1, 'free': []})
+            if floor >= series['next']:
+                series['next'] = floor + 1
+            free = sorted(n for n in series['free'] if n > floor)
+            numbers = free[:count]
+            series['free'] = free[count:]
+
+            start = series['next']
+            series['next'] = start + count - len(numbers)
+            numbers.extend(range(start, series['next']))
+        return numbers
+
+    def release(self, prefix: str, numbers: Iterable[int]) -> None:
+        """ Give back reserved numbers that were never used """
+        numbers = list(numbers)
+        if not numbers:
+            return
+        with self._locked() as state:
+            series = state.setdefault(prefix, {'next': 1, 'free': []})
+            series['free'] = sorted(set(series['free']).union(n for n in numbers if n < series['next']))
+
+    @contextmanager
+    def _locked(self) -> Iterator[Dict[str, Dict]]:
+        """ Hold the lock file while the shared state is read and written back """
+        token = self._acquire()
+        try:
+            try:
+                with open(self.shared_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except FileNotFoundError:
+                state = {}
+
+            yield state
+
+            tmp = self.shared_file.with_suffix(f'{self.shared_file.suffix}.{self.station}.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            # Another station may have broken the lock while this one stalled
+            if self._lock_token() != token:
+                os.remove(tmp)
+                raise TimeoutError(f'Lost the lock {self.lock_file}')
+            os.replace(tmp, self.shared_file)
+        finally:
+            self._release(token)
+
+    def _acquire(self) -> str:
+        token = f'{self.station} {os.getpid()} {uuid.uuid4().hex}'
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                self._break_stale_lock()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Could not lock {self.lock_file}')
+                time.sleep(0.05)
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(token)
+            return token
+
+    def _release(self, token: str) -> None:
+        """ Remove the lock if it is still the one taken with token """
+        if self._lock_token() == token:
+            try:
+                os.remove(self.lock_file)
+            except FileNotFoundError:
+                pass
+
+    def _lock_token(self) -> Optional[str]:
+        try:
+            with open(self.lock_file, 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _break_stale_lock(self) -> None:
+        """ Remove a lock left behind by a station that crashed while holding it """
+        token = self._lock_token()
+        try:
+            lock_time = self.lock_file.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if self._server_time() - lock_time > self.stale_after and self._lock_token() == token:
+            try:
+                os.remove(self.lock_file)
+            except FileNotFoundError:
+                pass
+
+    def _server_time(self) -> float:
+        """ Current time by the clock of the file server, so stations with a wrong clock agree on lock ages """
+        with open(self.clock_file, 'w') as f:
+            f.write(self.station)
+        return self.clock_file.stat().st_mtime
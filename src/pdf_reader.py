@@ -1,8 +1,23 @@
+import abc
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from PyPDF2 import PdfFileReader
+import fitz
+
+import pickle_file
+from document_pool import FITZ_LOCK
+
+try:
+    from PyPDF2 import PdfFileReader
+except ImportError:
+    PdfFileReader = None
+
+# extract_info only reads this many tokens from the start of the first page
+HEADER_TOKENS = 18
 
 
 @dataclass
@@ -17,13 +32,131 @@ class DocumentInfo:
     eta: str
     link: str
 
+@dataclass
+class ParseResult:
+    """ Outcome of parsing one PDF, with either info or an error message. `text` is
+        the text of the first page when it was read with read_document.
+    """
+    link: str
+    info: Optional[DocumentInfo] = None
+    error: Optional[str] = None
+    text: Optional[str] = None
+
+
+class MetadataCache:
+    """ Persistent cache of parsed DocumentInfo keyed by path and mtime """
+    def __init__(self, cache_file: Optional[Path] = None):
+        self.cache_file = cache_file
+        self._entries: Dict[str, Tuple[int, DocumentInfo]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if self.cache_file is not None and self.cache_file.exists():
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, link: str, mtime: int) -> Optional[DocumentInfo]:
+        with self._lock:
+            cached_mtime, info = self._entries.get(link, (None, None))
+        return info if cached_mtime == mtime else None
+
+    def put(self, link: str, mtime: int, info: DocumentInfo) -> None:
+        with self._lock:
+            self._entries[link] = (mtime, info)
+            self._dirty = True
+
+    def load(self) -> None:
+        entries = pickle_file.load(self.cache_file, {})
+
+        with self._lock:
+            self._entries = entries
+            self._dirty = False
+
+    def save(self) -> None:
+        """ Write the cache to file if it changed since it was loaded or saved """
+        if self.cache_file is None:
+            return
+
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+
+        pickle_file.save(self.cache_file, entries)
+
+
+class ExtractionBackend(abc.ABC):
+    """ Reads text from the first page of a PDF """
+    name = ''
+
+    @abc.abstractmethod
+    def extract_text(self, pdf_file: Path) -> str:
+        """ Text of the whole first page """
+
+    def header_tokens(self, pdf_file: Path, count: int) -> List[str]:
+        """ The first whitespace separated tokens of the first page """
+        return self.extract_text(pdf_file).split()[:count]
+
+    def read(self, pdf_file: Path, count: int) -> Tuple[List[str], str]:
+        """ Header tokens and text of the first page, reading the file once """
+        text = self.extract_text(pdf_file)
+        return text.split()[:count], text
+
+class PyPDF2Backend(ExtractionBackend):
+    name = 'PyPDF2'
 
-def extract_text(pdf_file: Path) -> str:
+    def extract_text(self, pdf_file: Path) -> str:
+        if PdfFileReader is None:
+            raise ImportError('PyPDF2 is not installed')
+
+        with open(pdf_file, 'rb') as stream:
+            reader = PdfFileReader(stream)
+            page = reader.getPage(0)
+            return page.extractText()
+
+class PyMuPDFBackend(ExtractionBackend):
+    """ Reads the header from the top of the page first, and only extracts the
+        whole page if the header region has too few tokens.
+    """
+    name = 'PyMuPDF'
+
+    def __init__(self, header_fraction: float = 0.25):
+        self.header_fraction = header_fraction
+
+    def extract_text(self, pdf_file: Path) -> str:
+        with FITZ_LOCK, fitz.open(pdf_file) as pdf:
+            return pdf[0].get_text()
+
+    def header_tokens(self, pdf_file: Path, count: int) -> List[str]:
+        # MuPDF loads lazily, so only the parts needed for the first page are read
+        with FITZ_LOCK, fitz.open(pdf_file) as pdf:
+            page = pdf[0]
+            tokens = page.get_text(clip=self._header_rect(page)).split()
+            if len(tokens) < count:
+                tokens = page.get_text().split()
+            return tokens[:count]
+
+    def read(self, pdf_file: Path, count: int) -> Tuple[List[str], str]:
+        with FITZ_LOCK, fitz.open(pdf_file) as pdf:
+            page = pdf[0]
+            text = page.get_text()
+            tokens = page.get_text(clip=self._header_rect(page)).split()
+        if len(tokens) < count:
+            tokens = text.split()
+        return tokens[:count], text
+
+    def _header_rect(self, page: fitz.Page) -> fitz.Rect:
+        rect = page.rect
+        return fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + rect.height * self.header_fraction)
+
+DEFAULT_BACKEND = PyMuPDFBackend()
+
+def extract_text(pdf_file: Path, backend: Optional[ExtractionBackend] = None) -> str:
     """ Extract text from PDF """
-    with open(pdf_file, 'rb') as stream:
-        reader = PdfFileReader(stream)
-        page = reader.getPage(0)
-        return page.extractText()
+    return (backend or DEFAULT_BACKEND).extract_text(pdf_file)
 
 def print_pdf_text(pdf_file: Path) -> None:
     """ Print content of PDF file """
@@ -32,10 +165,13 @@ def print_pdf_text(pdf_file: Path) -> None:
     for i, line in enumerate(text.split()):
         print(f'{i:03d} - {line}')
 
-def extract_info(pdf_file: Path) -> DocumentInfo:
+def extract_info(pdf_file: Path, backend: Optional[ExtractionBackend] = None) -> DocumentInfo:
     """ Extract content from PDF and construct an object """
-    text = extract_text(pdf_file)
-    arr = text.split()[:18]
+    return info_from_tokens((backend or DEFAULT_BACKEND).header_tokens(pdf_file, HEADER_TOKENS), pdf_file)
+
+def info_from_tokens(arr: List[str], pdf_file: Path) -> DocumentInfo:
+    """ Construct an object from the header tokens of a PDF """
+    arr = list(arr)
 
     # TODO: Validate content
     if arr[1] not in ('(UPDATED)', '(NEW)'):
@@ -53,19 +189,76 @@ def extract_info(pdf_file: Path) -> DocumentInfo:
         link=str(pdf_file)
     )
 
-def parse_folder_content(folder: Path, exclude: Optional[Dict[str, DocumentInfo]] = None) -> Dict[str, DocumentInfo]:
-    """ Parse PDFs in given folder for info and add them to documents """
-    if exclude is None:
-        exclude = {}
+def safe_extract_info(link: str, backend: Optional[ExtractionBackend] = None) -> ParseResult:
+    """ Extract info without raising, so one bad PDF doesn't stop a folder """
+    try:
+        return ParseResult(link, info=extract_info(Path(link), backend))
+    except Exception as e:
+        return ParseResult(link, error=f'{e.__class__.__qualname__}: {e}')
 
-    documents = {}
+def read_document(link: str, backend: Optional[ExtractionBackend] = None) -> ParseResult:
+    """ Read the info and the first page text in one pass, without raising. The text is
+        kept when the header can't be parsed, so the document can still be searched.
+    """
+    try:
+        tokens, text = (backend or DEFAULT_BACKEND).read(Path(link), HEADER_TOKENS)
+    except Exception as e:
+        return ParseResult(link, error=f'{e.__class__.__qualname__}: {e}')
+
+    try:
+        return ParseResult(link, info=info_from_tokens(tokens, Path(link)), text=text)
+    except Exception as e:
+        return ParseResult(link, error=f'{e.__class__.__qualname__}: {e}', text=text)
+
+def iter_folder_content(folder: Path, cache: Optional[MetadataCache] = None, max_workers: Optional[int] = None, chunksize: int = 16, backend: Optional[ExtractionBackend] = None) -> Iterator[ParseResult]:
+    """ Parse PDFs in given folder and yield the results as they are ready.
+
+        Cached results are yielded first. The rest are parsed in chunks on a process
+        pool, since parsing is CPU bound.
+    """
+    todo = {}
 
     for pdf in folder.glob('*.pdf'):
-        # Skip PDFs that have been stored in documents before
-        if str(pdf) in exclude:
+        link = str(pdf)
+        try:
+            mtime = pdf.stat().st_mtime_ns
+        except OSError as e:
+            yield ParseResult(link, error=f'{e.__class__.__qualname__}: {e}')
             continue
 
-        info = extract_info(pdf)
-        documents[info.link] = info
+        if cache is not None and (info := cache.get(link, mtime)) is not None:
+            yield ParseResult(link, info=info)
+        else:
+            todo[link] = mtime
+
+    extract = partial(safe_extract_info, backend=backend)
+
+    if len(todo) < chunksize:
+        # Not worth starting processes for
+        results = map(extract, todo)
+        yield from _cache_results(results, todo, cache)
+        return
+
+    with ProcessPoolExecutor(max_workers) as executor:
+        results = executor.map(extract, todo, chunksize=chunksize)
+        yield from _cache_results(results, todo, cache)
+
+def _cache_results(results: Iterator[ParseResult], mtimes: Dict[str, int], cache: Optional[MetadataCache]) -> Iterator[ParseResult]:
+    for result in results:
+        if cache is not None and result.info is not None:
+            cache.put(result.link, mtimes[result.link], result.info)
+        yield result
+
+def parse_folder_content(folder: Path, cache: Optional[MetadataCache] = None, failures: Optional[Dict[str, str]] = None) -> Dict[str, DocumentInfo]:
+    """ Parse PDFs in given folder for info and add them to documents. PDFs that
+        can't be parsed are left out and their errors added to failures.
+    """
+    documents = {}
+
+    for result in iter_folder_content(folder, cache):
+        if result.info is not None:
+            documents[result.link] = result.info
+        elif failures is not None:
+            failures[result.link] = result.error
     
     return documents
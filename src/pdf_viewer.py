@@ -1,33 +1,122 @@
+import bisect
 import logging
+import queue
 import tkinter as tk
 from pathlib import Path
 from tkinter import ttk
+from typing import Dict, List, Optional, Set, Tuple
 
 import fitz
 from PIL import Image, ImageTk
 
+from document_pool import DocumentPool
+from prefetch import Prefetcher
+from render_cache import Bitmap, PageBitmap, RenderCache, cache_key
+from render_worker import RenderRequest, RenderWorker
+
 logging.getLogger('PIL.PngImagePlugin').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+def render_bitmap(pdf: fitz.Document, page: int, width: int, tile: Optional[Tuple[int, int]] = None, tile_size: int = 0) -> PageBitmap:
+    """ Rasterize the page at the given width into PPM data for Tk. With a tile, only
+        the tile_size square at that column and row of the scaled page is rendered.
+    """
+    pdf_page = pdf[page]
+    rect = pdf_page.rect
+
+    zoom = width / rect.width
+    clip = rect
+    if tile is not None:
+        tx, ty = tile
+        clip = fitz.Rect(tx * tile_size, ty * tile_size, (tx + 1) * tile_size, (ty + 1) * tile_size) / zoom
+        clip = (clip + (rect.x0, rect.y0, rect.x0, rect.y0)) & rect
+
+    pix = pdf_page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+    return PageBitmap(pix.width, pix.height, pix.tobytes('ppm'))
+
+def as_image(bitmap: Bitmap) -> Image.Image:
+    return bitmap.to_image() if isinstance(bitmap, PageBitmap) else bitmap
+
+# A page, or a tile of a page as (column, row), drawn on the canvas
+ItemKey = Tuple[int, Optional[Tuple[int, int]]]
+
 class PdfViewer:
+    """ Displays all pages of a PDF below each other on a canvas.
+
+        Every page gets a placeholder sized from its page rect, and only pages in or
+        near the visible part of the canvas are rasterized. Pages that scroll out of
+        range have their bitmaps freed.
+
+        Rendering runs on a RenderWorker. Until a sharp page arrives, the bitmap
+        shown before a resize is scaled to the new size, and results for a document
+        or width that is no longer displayed are dropped.
+
+        When zoomed in, pages are split into square tiles and only the tiles in or
+        near the view are rendered, so memory use does not grow with the zoom level.
+    """
     def __init__(self, **kwargs):
         self._pdf_file = None
-        self.filter = kwargs.get('filter', Image.LANCZOS)
+        self.preview_filter = kwargs.get('preview_filter', Image.NEAREST)
         self.resize_delay = kwargs.get('resize_delay', 5)
+        self.poll_interval = kwargs.get('poll_interval', 15)
+        self.cache = kwargs.get('cache', RenderCache(kwargs.get('cache_size', 256 * 1024 * 1024)))
+        self.pool = DocumentPool(kwargs.get('pool_size', 8))
+        self.page_gap = kwargs.get('page_gap', 8)
+        # Viewport heights above and below the view to keep rendered
+        self.render_margin = kwargs.get('render_margin', 1.0)
+        self.zoom_levels = kwargs.get('zoom_levels', (1.0, 1.5, 2.0, 3.0, 4.0))
+        self.tile_size = kwargs.get('tile_size', 512)
         
         self._canvas = None
+        self._vbar = None
+        self._hbar = None
+
+        self._page_rects: List[fitz.Rect] = []
+        self._page_tops: List[int] = []
+        self._page_heights: List[int] = []
+        # Item -> (canvas item, photo image, bitmap, is rendered at the current width)
+        self._page_images: Dict[ItemKey, Tuple[int, tk.PhotoImage, Bitmap, bool]] = {}
+        self._requested: Set[Optional[ItemKey]] = set()
+        self._width = 0
+        self._zoom_index = 0
+
+        self.worker = RenderWorker(self.cache, self.pool, render_bitmap)
+        self.worker.start()
+        self.prefetcher = Prefetcher(self.cache, self.pool, render_bitmap)
+        self.prefetcher.start()
         
         self.__resize_event_id = None
+        self.__scroll_event_id = None
+        self.__poll_event_id = None
     
+    @property
+    def page_count(self) -> int:
+        return len(self._page_rects)
+
+    @property
+    def generation(self) -> int:
+        return self.worker.generation
+
+    @property
+    def zoom(self) -> float:
+        return self.zoom_levels[self._zoom_index]
+
+    @property
+    def is_tiled(self) -> bool:
+        return self.zoom > 1.0
+
     def create_viewer(self, master) -> ttk.Frame:
         frame = ttk.Frame(master)
 
-        vbar = ttk.Scrollbar(frame, orient='vertical')
-        vbar.grid(row=0, column=1, sticky='ns')
+        self._vbar = ttk.Scrollbar(frame, orient='vertical')
+        self._vbar.grid(row=0, column=1, sticky='ns')
+        self._hbar = ttk.Scrollbar(frame, orient='horizontal')
+        self._hbar.grid(row=1, column=0, sticky='we')
 
-        self._canvas = tk.Canvas(frame, yscrollcommand=vbar.set)
+        self._canvas = tk.Canvas(frame, yscrollcommand=self.__on_yscroll, xscrollcommand=self.__on_xscroll)
         
-        vbar.configure(command=self._canvas.yview)
+        self._vbar.configure(command=self._canvas.yview)
+        self._hbar.configure(command=self._canvas.xview)
         
         self._canvas.grid(row=0, column=0, sticky='nswe')
         self._canvas.update()
@@ -37,59 +126,294 @@ class PdfViewer:
 
         self._canvas.grid(row=0, column=0)
         self._canvas.bind('<MouseWheel>', self.__wheel)
+        self._canvas.bind('<Shift-MouseWheel>', self.__shift_wheel)
+        self._canvas.bind('<Control-MouseWheel>', self.__control_wheel)
         self._canvas.bind('<Configure>', self._on_resize)
 
         return frame
     
     def display(self, filename: Path) -> None:
-        """ Set file if valid and update display """
+        """ Set file if valid and update display. The page layout is read by the worker """
         if filename.suffix.lower() != '.pdf':
             return
 
         self._pdf_file = filename
-        self._open_page(0)
+        self._zoom_index = 0
+        self.__new_generation()
+
+        # Clear the previous document while the page layout is read
+        self._page_rects = []
+        self.__layout_pages()
+        self._requested.add(None)
+        self.__submit(RenderRequest(filename, self.generation))
+
+    def prefetch(self, filenames: List[Path]) -> None:
+        """ Render the first view of the documents in the background, in order """
+        if self._canvas is None:
+            return
+
+        filenames = [f for f in filenames if f.suffix.lower() == '.pdf']
+        self.prefetcher.prefetch(filenames, self._canvas.winfo_width(), self._canvas.winfo_height())
+
+    def cancel_prefetch(self) -> None:
+        self.prefetcher.cancel()
+
+    def release(self, filename: Path) -> None:
+        """ Close any open handle to the file, e.g. before it is moved """
+        self.pool.release(filename)
+
+    def block(self, filename: Path) -> None:
+        """ Close the file and keep it closed while it is transferred """
+        self.pool.block(filename)
+
+    def unblock(self, filename: Path) -> None:
+        self.pool.unblock(filename)
+
+    def close(self) -> None:
+        self.worker.stop()
+        self.prefetcher.stop()
+        self.pool.close()
+
+    def zoom_in(self) -> None:
+        self.set_zoom(self._zoom_index + 1)
+
+    def zoom_out(self) -> None:
+        self.set_zoom(self._zoom_index - 1)
+
+    def set_zoom(self, index: int) -> None:
+        """ Change to one of the zoom levels, keeping the center of the view in place """
+        index = min(max(index, 0), len(self.zoom_levels) - 1)
+        if index == self._zoom_index:
+            return
+
+        self._zoom_index = index
+        self.__relayout()
+
+    def __new_generation(self) -> None:
+        """ Make all outstanding requests stale """
+        self.worker.generation += 1
+        self._requested = set()
+
+    def __submit(self, request: RenderRequest) -> None:
+        self.worker.submit(request)
+        if self.__poll_event_id is None:
+            self.__poll_event_id = self._canvas.after(self.poll_interval, self.__poll_results)
+
+    def __poll_results(self) -> None:
+        """ Hand finished renders to the canvas on the Tk thread """
+        self.__poll_event_id = None
+
+        while True:
+            try:
+                result = self.worker.results.get_nowait()
+            except queue.Empty:
+                break
+
+            request = result.request
+            if self.worker.is_stale(request) or request.path != self._pdf_file:
+                continue
+
+            key = None if request.page is None else (request.page, request.tile)
+            self._requested.discard(key)
+            if result.error is not None:
+                logger.warning(f'Could not render {request.path}: {result.error}')
+                continue
+
+            if key is None:
+                self._page_rects = result.value
+                self._open_page(0)
+            elif request.width == self._width and key in self.visible_items(self.render_margin):
+                self.__draw_item(key, result.value, sharp=True)
+
+        if self._requested or not self.worker.requests.empty():
+            self.__poll_event_id = self._canvas.after(self.poll_interval, self.__poll_results)
+
+    def __layout_pages(self) -> Dict[ItemKey, Bitmap]:
+        """ Draw a placeholder for every page and set the scroll region. Returns the
+            images that were shown so they can be scaled while new ones render.
+        """
+        shown = {key: img for key, (_, _, img, _) in self._page_images.items()}
 
-    def __create_page_image(self, page: int):
         self._canvas.delete('all')
+        self._page_images = {}
+        self._page_tops = []
+        self._page_heights = []
 
-        with fitz.open(self._pdf_file) as pdf:
-            # Get image data from the pdf page
-            pix = pdf.get_page_pixmap(page)
-            img = Image.frombytes('RGB', [pix.width, pix.height], pix.samples)
-
-            # Resize image to fit canvas width
-            width = self._canvas.winfo_width()
-            w, h = img.size
-            percent = width / w
-            h = int(h*percent)
-            img = img.resize((width, h), self.filter)
-            
-            # Draw iamge on the canvas
+        self._width = width = round(self._canvas.winfo_width() * self.zoom)
+        y = 0
+        for rect in self._page_rects:
+            height = round(rect.height * width / rect.width)
+            self._canvas.create_rectangle(0, y, width, y + height, fill='white', outline='grey')
+            self._page_tops.append(y)
+            self._page_heights.append(height)
+            y += height + self.page_gap
+
+        self._canvas.configure(scrollregion=(0, 0, width, max(y - self.page_gap, 0)))
+        return shown
+
+    def __draw_item(self, key: ItemKey, img: Bitmap, sharp: bool) -> None:
+        if key in self._page_images:
+            self._canvas.delete(self._page_images[key][0])
+
+        page, tile = key
+        x, y = 0, self._page_tops[page]
+        if tile is not None:
+            x += tile[0] * self.tile_size
+            y += tile[1] * self.tile_size
+
+        # Draw iamge on the canvas, keeping a reference to avoid garbage collection
+        if isinstance(img, PageBitmap):
+            imagetk = img.photo(self._canvas)
+        else:
             imagetk = ImageTk.PhotoImage(img)
-            img_id = self._canvas.create_image(0, 0, anchor='nw', image=imagetk)
-            self._canvas.lower(img_id)
-            
-            # Keep a reference to the image to avoid garbage collection
-            self._canvas.imagetk = imagetk
-
-            # Set the scroll region for the canvas to match image dimensions
-            self._canvas.configure(scrollregion=self._canvas.bbox("all"))
+        img_id = self._canvas.create_image(x, y, anchor='nw', image=imagetk)
+        self._page_images[key] = (img_id, imagetk, img, sharp)
+
+    def __create_item_image(self, key: ItemKey, previous: Optional[Bitmap] = None):
+        """ Draw the page or tile from cache, or request it and show the previous image scaled """
+        page, tile = key
+        width = self._width
+
+        try:
+            img = self.cache.get(cache_key(self._pdf_file, page, width, tile))
+        except OSError:
+            return
+
+        if img is not None:
+            self.__draw_item(key, img, sharp=True)
+            return
+
+        if previous is not None and tile is None:
+            preview = as_image(previous).resize((width, self._page_heights[page]), self.preview_filter)
+            self.__draw_item(key, preview, sharp=False)
+
+        if key not in self._requested:
+            self._requested.add(key)
+            self.__submit(RenderRequest(self._pdf_file, self.generation, page, width, tile, self.tile_size))
+
+    def visible_pages(self, margin: float = 0.0) -> range:
+        """ Pages within the view, extended by `margin` view heights above and below """
+        if not self._page_tops:
+            return range(0)
+
+        height = self._canvas.winfo_height()
+        top = self._canvas.canvasy(0) - margin * height
+        bottom = self._canvas.canvasy(0) + height + margin * height
+
+        first = max(bisect.bisect_right(self._page_tops, top) - 1, 0)
+        last = bisect.bisect_left(self._page_tops, bottom)
+        return range(first, min(last, self.page_count))
+
+    def visible_items(self, margin: float = 0.0) -> Set[ItemKey]:
+        """ Pages, or tiles when zoomed in, within the view extended by `margin` """
+        pages = self.visible_pages(margin)
+        if not self.is_tiled:
+            return {(page, None) for page in pages}
+
+        height = self._canvas.winfo_height()
+        top = self._canvas.canvasy(0) - margin * height
+        bottom = self._canvas.canvasy(0) + height + margin * height
+        left = self._canvas.canvasx(0)
+        right = left + self._canvas.winfo_width()
+
+        size = self.tile_size
+        columns = range(max(int(left // size) - 1, 0), min(int(right // size) + 2, -(-self._width // size)))
+
+        items = set()
+        for page in pages:
+            page_top = self._page_tops[page]
+            first_row = max(int((top - page_top) // size), 0)
+            last_row = min(int((bottom - page_top) // size), (self._page_heights[page] - 1) // size)
+            for row in range(first_row, last_row + 1):
+                items.update((page, (column, row)) for column in columns)
+        return items
+
+    def _update_visible_pages(self, previous: Optional[Dict[ItemKey, Bitmap]] = None) -> None:
+        """ Render pages near the view and free the bitmaps of pages further away """
+        self.__scroll_event_id = None
+        if not self._pdf_file:
+            return
+
+        previous = previous or {}
+        items = self.visible_items(self.render_margin)
+
+        for key in [k for k in self._page_images if k not in items]:
+            img_id, *_ = self._page_images.pop(key)
+            self._canvas.delete(img_id)
+
+        # Nearest first, so the view fills in from the top
+        for key in sorted(items, key=lambda k: (k[0], k[1] and k[1][::-1])):
+            if key not in self._page_images or not self._page_images[key][3]:
+                self.__create_item_image(key, previous.get(key))
     
+    def __schedule_update(self) -> None:
+        if self.__scroll_event_id is None:
+            self.__scroll_event_id = self._canvas.after_idle(self._update_visible_pages)
+
+    def __on_yscroll(self, first, last) -> None:
+        self._vbar.set(first, last)
+        self.__schedule_update()
+
+    def __on_xscroll(self, first, last) -> None:
+        self._hbar.set(first, last)
+        self.__schedule_update()
+
     def __wheel(self, event = None) -> None:
         self._canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+
+    def __shift_wheel(self, event = None) -> None:
+        self._canvas.xview_scroll(int(-1*(event.delta/120)), "units")
+
+    def __control_wheel(self, event = None) -> None:
+        if event.delta > 0:
+            self.zoom_in()
+        else:
+            self.zoom_out()
         
     def _open_page(self, page = 0) -> None:
+        """ Lay out the pages at the current width and scroll to the page """
         if not self._pdf_file:
             return
 
-        self.__create_page_image(page)
+        self.__layout_pages()
+        self.show_page(page)
+
+    def show_page(self, page: int) -> None:
+        if 0 <= page < self.page_count:
+            bbox = self._canvas.cget('scrollregion').split()
+            total = float(bbox[3]) if len(bbox) == 4 else 0
+            self._canvas.yview_moveto(self._page_tops[page] / total if total else 0)
+        self._update_visible_pages()
 
     def _on_resize(self, event = None) -> None:
         if self.__resize_event_id is not None:
             self._canvas.after_cancel(self.__resize_event_id)
             self.__resize_event_id = None
         
-        self.__resize_event_id = self._canvas.after(self.resize_delay, self._open_page)
+        self.__resize_event_id = self._canvas.after(self.resize_delay, self.__relayout)
+
+    def __relayout(self) -> None:
+        """ Lay out the pages again at a new width, keeping the center of the view.
+            The current bitmaps are shown scaled until the sharp renders arrive.
+        """
+        self.__resize_event_id = None
+        if not self._pdf_file or not self._page_rects:
+            return
+
+        if round(self._canvas.winfo_width() * self.zoom) == self._width:
+            self._update_visible_pages()
+            return
+
+        self.__new_generation()
+        x_center = sum(self._canvas.xview()) / 2
+        y_center = sum(self._canvas.yview()) / 2
+        shown = self.__layout_pages()
+
+        x_first, x_last = self._canvas.xview()
+        y_first, y_last = self._canvas.yview()
+        self._canvas.xview_moveto(x_center - (x_last - x_first) / 2)
+        self._canvas.yview_moveto(y_center - (y_last - y_first) / 2)
+        self._update_visible_pages(shown)
 
 if __name__ == "__main__":
     import ctypes
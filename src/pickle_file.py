@@ -0,0 +1,20 @@
+import os
+import pickle
+from pathlib import Path
+from typing import Any
+
+
+def load(path: Path, default: Any) -> Any:
+    """ Unpickle path, or return default if the file is missing or unreadable """
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return default
+
+def save(path: Path, data: Any) -> None:
+    """ Pickle data to path, replacing the old file atomically """
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp, 'wb') as f:
+        pickle.dump(data, f)
+    os.replace(tmp, path)
@@ -0,0 +1,81 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from document_pool import FITZ_LOCK, DocumentPool
+from render_cache import RenderCache, cache_key
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher(threading.Thread):
+    """ Render the first pages of upcoming documents into the render cache.
+
+        Each call to prefetch() replaces the pending work, so documents that were
+        queued for an earlier selection are dropped.
+    """
+    def __init__(self, cache: RenderCache, pool: DocumentPool, render):
+        super().__init__(name='Prefetcher', daemon=True)
+        self.cache = cache
+        self.pool = pool
+        self.render = render
+
+        self._pending: List[Tuple[Path, int, int]] = []
+        self._generation = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def prefetch(self, paths: Iterable[Path], width: int, height: int) -> None:
+        """ Render enough of each document to fill a view of width x height """
+        with self._condition:
+            self._generation += 1
+            self._pending = [(Path(p), width, height) for p in paths]
+            self._condition.notify()
+
+    def cancel(self) -> None:
+        self.prefetch([], 0, 0)
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._pending = []
+            self._condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                generation = self._generation
+                path, width, height = self._pending.pop(0)
+
+            try:
+                self._prefetch(path, width, height, generation)
+            except Exception as e:
+                logger.debug(f'Prefetch of {path} failed: {e}')
+
+    def _prefetch(self, path: Path, width: int, height: int, generation: int) -> None:
+        y = 0
+        page = 0
+        while y < height:
+            if generation != self._generation:
+                return
+
+            key = cache_key(path, page, width)
+            with FITZ_LOCK:
+                pdf = self.pool.get(path)
+                if page >= pdf.page_count:
+                    return
+                if key not in self.cache:
+                    self.cache.put(key, self.render(pdf, page, width))
+                rect = pdf[page].rect
+
+            y += rect.height * width / rect.width
+            page += 1
@@ -0,0 +1,106 @@
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Hashable, Optional, Tuple, Union
+
+from PIL import Image
+
+CacheKey = Tuple[str, int, int, int, Optional[Tuple[int, int]]]
+
+
+@dataclass(frozen=True)
+class PageBitmap:
+    """ Rendered page stored as a binary PPM, which Tk can load without PIL """
+    width: int
+    height: int
+    ppm: bytes
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.ppm)
+
+    def photo(self, master=None) -> tk.PhotoImage:
+        """ Let Tk decode the pixels straight into a photo image """
+        return tk.PhotoImage(master=master, data=self.ppm, format='PPM')
+
+    def to_image(self) -> Image.Image:
+        """ PIL image that shares the pixel buffer with the PPM data """
+        offset = len(self.ppm) - self.width * self.height * 3
+        pixels = memoryview(self.ppm)[offset:]
+        return Image.frombuffer('RGB', (self.width, self.height), pixels, 'raw', 'RGB', 0, 1)
+
+Bitmap = Union[PageBitmap, Image.Image]
+
+
+def cache_key(path: Path, page: int, width: int, tile: Optional[Tuple[int, int]] = None) -> CacheKey:
+    """ Key for a rendered page or tile, a new mtime makes older renders unreachable """
+    return (str(path), path.stat().st_mtime_ns, page, width, tile)
+
+def image_size(img: Bitmap) -> int:
+    """ Number of bytes used by the image pixels """
+    if isinstance(img, PageBitmap):
+        return img.nbytes
+    return img.width * img.height * len(img.getbands())
+
+
+class RenderCache:
+    """ LRU cache of rendered page images limited by total byte size """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._images: 'OrderedDict[Hashable, Bitmap]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._images
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    def get(self, key: Hashable) -> Optional[Bitmap]:
+        with self._lock:
+            img = self._images.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+
+            self._images.move_to_end(key)
+            self.hits += 1
+            return img
+
+    def put(self, key: Hashable, img: Bitmap) -> None:
+        nbytes = image_size(img)
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if (old := self._images.pop(key, None)) is not None:
+                self._bytes -= image_size(old)
+
+            self._images[key] = img
+            self._bytes += nbytes
+
+            while self._bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= image_size(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return (f'<{self.__class__.__qualname__}({len(self._images)} pages, '
+                f'{self._bytes / 1e6:.1f}/{self.max_bytes / 1e6:.1f} MB, '
+                f'hits={self.hits}, misses={self.misses}, ratio={ratio:.2f})>')
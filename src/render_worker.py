@@ -0,0 +1,92 @@
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
+
+from document_pool import FITZ_LOCK, DocumentPool
+from render_cache import RenderCache, cache_key
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RenderRequest:
+    """ Request for the page rects of a document (page is None), a rendered page, or
+        a tile of a page given as (column, row)
+    """
+    path: Path
+    generation: int
+    page: Optional[int] = None
+    width: int = 0
+    tile: Optional[Tuple[int, int]] = None
+    tile_size: int = 0
+
+@dataclass
+class RenderResult:
+    request: RenderRequest
+    value: Any = None
+    error: Optional[Exception] = None
+
+
+class RenderWorker(threading.Thread):
+    """ Render pages away from the Tk thread.
+
+        Requests are tagged with the generation they were made in. The owner bumps
+        `generation` whenever the view changes, and requests from older generations
+        are dropped without being rendered.
+    """
+    def __init__(self, cache: RenderCache, pool: DocumentPool, render: Callable[..., Any]):
+        super().__init__(name='RenderWorker', daemon=True)
+        self.cache = cache
+        self.pool = pool
+        self.render = render
+        self.generation = 0
+
+        self.requests: 'queue.Queue[Optional[RenderRequest]]' = queue.Queue()
+        self.results: 'queue.Queue[RenderResult]' = queue.Queue()
+
+    def submit(self, request: RenderRequest) -> None:
+        self.requests.put(request)
+
+    def stop(self) -> None:
+        self.requests.put(None)
+
+    def is_stale(self, request: RenderRequest) -> bool:
+        return request.generation != self.generation
+
+    def run(self) -> None:
+        while (request := self.requests.get()) is not None:
+            if self.is_stale(request):
+                continue
+
+            result = RenderResult(request)
+            try:
+                result.value = self._page_rects(request) if request.page is None else self._render(request)
+            except Exception as e:
+                logger.debug(f'Render of {request} failed: {e}')
+                result.error = e
+
+            if not self.is_stale(request):
+                self.results.put(result)
+
+    def _page_rects(self, request: RenderRequest):
+        with FITZ_LOCK:
+            pdf = self.pool.get(request.path)
+            return [page.rect for page in pdf]
+
+    def _render(self, request: RenderRequest):
+        key = cache_key(request.path, request.page, request.width, request.tile)
+        if (img := self.cache.get(key)) is not None:
+            return img
+
+        with FITZ_LOCK:
+            pdf = self.pool.get(request.path)
+            if request.tile is None:
+                img = self.render(pdf, request.page, request.width)
+            else:
+                img = self.render(pdf, request.page, request.width, request.tile, request.tile_size)
+
+        self.cache.put(key, img)
+        return img
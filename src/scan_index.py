@@ -0,0 +1,203 @@
+import fnmatch
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import pickle_file
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ScanEntry:
+    """ Stat signature of a scanned file """
+    path: Path
+    size: int
+    mtime: int
+    inode: int
+
+@dataclass
+class ScanDelta:
+    """ Difference between two scans of the same folders """
+    added: List[ScanEntry] = field(default_factory=list)
+    removed: List[ScanEntry] = field(default_factory=list)
+    changed: List[ScanEntry] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def extend(self, other: 'ScanDelta') -> None:
+        self.added.extend(other.added)
+        self.removed.extend(other.removed)
+        self.changed.extend(other.changed)
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def split(self, size: int) -> List['ScanDelta']:
+        """ Split into deltas of at most size entries, removals first """
+        entries = ([('removed', e) for e in self.removed] + [('changed', e) for e in self.changed]
+                   + [('added', e) for e in self.added])
+        parts = []
+        for i in range(0, len(entries), size):
+            part = ScanDelta()
+            for kind, entry in entries[i:i + size]:
+                getattr(part, kind).append(entry)
+            parts.append(part)
+        return parts
+
+
+class ScanIndex:
+    """ Persistent index of files in the source folders.
+
+        Each file is keyed by path and stored with size, mtime and inode, so a rescan
+        only has to report the files that were added, removed or changed since last time.
+    """
+    def __init__(self, index_file: Optional[Path] = None, pattern: str = '*.pdf'):
+        self.index_file = index_file
+        self.pattern = pattern
+        self._entries: Dict[Path, ScanEntry] = {}
+        self._lock = threading.Lock()
+
+        if self.index_file is not None and self.index_file.exists():
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, path: Path) -> bool:
+        return path in self._entries
+
+    def get(self, path: Path) -> Optional[ScanEntry]:
+        with self._lock:
+            return self._entries.get(path)
+
+    @property
+    def entries(self) -> List[ScanEntry]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def load(self) -> None:
+        """ Load the index from file, starting empty if it is unreadable """
+        entries = pickle_file.load(self.index_file, {})
+
+        with self._lock:
+            self._entries = entries
+
+    def save(self) -> None:
+        """ Write the index to file, replacing the old one atomically """
+        if self.index_file is None:
+            return
+
+        with self._lock:
+            entries = dict(self._entries)
+
+        pickle_file.save(self.index_file, entries)
+
+    def rescan(self, folders: Iterable[Path]) -> ScanDelta:
+        """ Scan the folders and return the delta against the index """
+        delta = ScanDelta()
+
+        for folder in folders:
+            delta.extend(self.rescan_folder(folder))
+
+        return delta
+
+    def rescan_folder(self, folder: Path) -> ScanDelta:
+        """ Scan a single folder and return the delta against the index.
+            A folder that can't be listed keeps its entries until it is reachable again.
+        """
+        current = self._scan_folder(folder)
+        if current is None:
+            return ScanDelta()
+
+        with self._lock:
+            previous = {p: e for p, e in self._entries.items() if p.parent == folder}
+            delta = self._diff(previous, current)
+            self._apply(delta)
+
+        return delta
+
+    def update_paths(self, paths: Iterable[Path]) -> ScanDelta:
+        """ Restat the given paths only and return the delta against the index """
+        paths = {Path(p) for p in paths if self._matches(Path(p).name)}
+        current = {}
+
+        for path in paths:
+            try:
+                current[path] = self._entry(path, os.stat(path))
+            except OSError:
+                pass
+
+        with self._lock:
+            previous = {p: self._entries[p] for p in paths if p in self._entries}
+            delta = self._diff(previous, current)
+            self._apply(delta)
+
+        return delta
+
+    def forget(self, paths: Iterable[Path]) -> None:
+        """ Remove paths from the index without reporting them as removed """
+        with self._lock:
+            for path in paths:
+                self._entries.pop(path, None)
+
+    def _scan_folder(self, folder: Path) -> Optional[Dict[Path, ScanEntry]]:
+        """ Entries of the files in folder, None if the folder couldn't be listed """
+        entries = {}
+
+        # DirEntry caches the stat result from the directory listing, which saves
+        # a round-trip per file on network shares.
+        try:
+            with os.scandir(folder) as it:
+                for dir_entry in it:
+                    if not self._matches(dir_entry.name):
+                        continue
+                    try:
+                        if not dir_entry.is_file():
+                            continue
+                        st = dir_entry.stat()
+                        path = folder / dir_entry.name
+                        entries[path] = ScanEntry(path, st.st_size, st.st_mtime_ns, dir_entry.inode())
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f'Skipping {folder}, it could not be listed: {e}')
+            return None
+
+        return entries
+
+    def _matches(self, name: str) -> bool:
+        return fnmatch.fnmatch(name, self.pattern)
+
+    @staticmethod
+    def _entry(path: Path, st: os.stat_result) -> ScanEntry:
+        return ScanEntry(path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+    @staticmethod
+    def _diff(previous: Dict[Path, ScanEntry], current: Dict[Path, ScanEntry]) -> ScanDelta:
+        delta = ScanDelta()
+
+        for path, entry in current.items():
+            old = previous.get(path)
+            if old is None:
+                delta.added.append(entry)
+            elif old != entry:
+                delta.changed.append(entry)
+
+        for path, entry in previous.items():
+            if path not in current:
+                delta.removed.append(entry)
+
+        return delta
+
+    def _apply(self, delta: ScanDelta) -> None:
+        for entry in delta.added:
+            self._entries[entry.path] = entry
+        for entry in delta.changed:
+            self._entries[entry.path] = entry
+        for entry in delta.removed:
+            self._entries.pop(entry.path, None)
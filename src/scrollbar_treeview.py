@@ -88,7 +88,8 @@ class ScrollbarTreeview(ttk.Treeview):
         self.scrollbar = AutohideScrollbar(self, command_wrapper=self.__wrapper)
 
     def __wrapper(self, callback, *args):
-        callback(*args)
+        # Ask the view, which may report a different range than the widget
+        callback(*self.yview())
         self.on_scroll()
     
     def on_scroll(self):
@@ -0,0 +1,66 @@
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, Iterator, Optional, Set
+
+
+def ngrams(text: str, n: int) -> Iterator[str]:
+    return (text[i:i + n] for i in range(len(text) - n + 1))
+
+
+class SearchIndex:
+    """ N-gram index for case insensitive substring search over short texts.
+
+        Candidates are found by intersecting the n-gram postings of the query and
+        then checked against the stored text, so results match `query in text`.
+    """
+    def __init__(self, n: int = 3):
+        self.n = n
+        self._texts: Dict[Hashable, str] = {}
+        self._grams: Dict[str, Set[Hashable]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def update(self, key: Hashable, text: str) -> bool:
+        """ Index text for key, returns False if it was indexed with the same text """
+        text = text.lower()
+        old = self._texts.get(key)
+        if old == text:
+            return False
+
+        if old is not None:
+            self._unindex(key, old)
+        self._texts[key] = text
+        for gram in set(ngrams(text, self.n)):
+            self._grams[gram].add(key)
+        return True
+
+    def remove(self, key: Hashable) -> None:
+        if (text := self._texts.pop(key, None)) is not None:
+            self._unindex(key, text)
+
+    def clear(self) -> None:
+        self._texts.clear()
+        self._grams.clear()
+
+    def search(self, query: str, within: Optional[Iterable[Hashable]] = None) -> Set[Hashable]:
+        """ Keys whose text contains query. `within` limits the search to earlier results """
+        query = query.lower()
+
+        if within is not None:
+            candidates = within
+        elif len(query) < self.n:
+            candidates = self._texts.keys()
+        else:
+            postings = sorted((self._grams.get(gram, set()) for gram in set(ngrams(query, self.n))), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+
+        texts = self._texts
+        return {key for key in candidates if query in texts.get(key, '')}
+
+    def _unindex(self, key: Hashable, text: str) -> None:
+        for gram in set(ngrams(text, self.n)):
+            keys = self._grams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._grams[gram]
@@ -0,0 +1,149 @@
+import logging
+import pickle
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import model
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mappings (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    prefix TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS series (
+    prefix TEXT PRIMARY KEY,
+    number INTEGER NOT NULL,
+    current_number INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    link TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    name TEXT NOT NULL,
+    dst_folder TEXT,
+    moved_to TEXT,
+    date TEXT NOT NULL
+);
+"""
+
+
+class StateStore:
+    """ SQLite store for folder mappings, number series and the state of registered documents.
+
+        Every save is its own transaction, so the state on disk follows the GUI as
+        changes are made and survives a crash. Documents with status OK carry no
+        state and are not stored. The database is in WAL mode, which keeps the
+        small, frequent commits cheap.
+    """
+    # Links looked up per query, below the SQLite limit on parameters
+    QUERY_SIZE = 500
+
+    def __init__(self, db_file: Path = Path(':memory:')):
+        self.db_file = db_file
+        self._db = sqlite3.connect(str(db_file))
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def mappings(self) -> List[model.FolderMapping]:
+        rows = self._db.execute('SELECT source, destination, prefix FROM mappings ORDER BY id').fetchall()
+        return [model.FolderMapping(Path(source), Path(destination), prefix) for source, destination, prefix in rows]
+
+    def series(self) -> Dict[str, model.NumberSeries]:
+        series = {}
+        for prefix, number, current_number in self._db.execute('SELECT prefix, number, current_number FROM series'):
+            ns = model.NumberSeries(prefix, number)
+            # Numbers handed out to registered documents that were not moved yet
+            ns.current_number = current_number
+            series[prefix] = ns
+        return series
+
+    def documents(self, links: Iterable[Path]) -> Dict[Path, model.DocumentInfo]:
+        """ Stored state of the files at links. Files that were moved away are left
+            out, a file found at their path now is a new document.
+        """
+        links = [str(link) for link in links]
+        documents = {}
+        for i in range(0, len(links), self.QUERY_SIZE):
+            chunk = links[i:i + self.QUERY_SIZE]
+            rows = self._db.execute(
+                'SELECT link, status, name, dst_folder, date FROM documents '
+                f'WHERE moved_to IS NULL AND link IN ({", ".join("?" * len(chunk))})', chunk)
+            for link, status, name, dst_folder, date in rows:
+                d = model.DocumentInfo(Path(link))
+                d.status = model.Status[status]
+                d.name = name
+                d.dst_folder = Path(dst_folder) if dst_folder is not None else None
+                d.date = datetime.fromisoformat(date)
+                documents[d.link] = d
+        return documents
+
+    def save(self, documents: Iterable[model.DocumentInfo] = (), series: Iterable[model.NumberSeries] = ()) -> None:
+        """ Write documents and series in one transaction """
+        with self._db:
+            self._save_series(series)
+            self._save_documents(documents)
+
+    def setting(self, key: str) -> Optional[str]:
+        row = self._db.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def save_setting(self, key: str, value: str) -> None:
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+
+    def save_mappings(self, mappings: Iterable[model.FolderMapping]) -> None:
+        with self._db:
+            self._db.execute('DELETE FROM mappings')
+            self._db.executemany('INSERT INTO mappings (source, destination, prefix) VALUES (?, ?, ?)',
+                                 [(str(m.source), str(m.destination), m.prefix) for m in mappings])
+
+    def migrate_pickles(self, pkl_ms: Path, pkl_ns: Path) -> None:
+        """ Import mappings and series from the pickles used before the store.
+            The pickles are renamed afterwards so they are only imported once.
+        """
+        for pkl in (pkl_ms, pkl_ns):
+            if not pkl.exists():
+                continue
+            with open(pkl, 'rb') as f:
+                data = pickle.load(f)
+
+            if pkl == pkl_ms:
+                self.save_mappings(data)
+            else:
+                self.save(series=data.values())
+            pkl.replace(pkl.with_suffix(pkl.suffix + '.migrated'))
+            logger.info(f'Migrated {pkl} to {self.db_file}')
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _save_series(self, series: Iterable[model.NumberSeries]) -> None:
+        self._db.executemany(
+            'INSERT INTO series (prefix, number, current_number) VALUES (?, ?, ?) '
+            'ON CONFLICT (prefix) DO UPDATE SET number = excluded.number, current_number = excluded.current_number',
+            [(ns.prefix, ns.number, ns.current_number) for ns in series])
+
+    def _save_documents(self, documents: Iterable[model.DocumentInfo]) -> None:
+        stored, cleared = [], []
+        for d in documents:
+            if d.status == model.Status.OK:
+                cleared.append((str(d.link),))
+                continue
+            stored.append((str(d.link), str(d.source), d.status.name, d.name,
+                           str(d.dst_folder) if d.dst_folder is not None else None,
+                           str(d.moved_to) if d.moved_to is not None else None,
+                           d.date.isoformat()))
+
+        self._db.executemany('DELETE FROM documents WHERE link = ?', cleared)
+        self._db.executemany('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)', stored)
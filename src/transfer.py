@@ -0,0 +1,392 @@
+import errno
+import logging
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from hashing import file_checksum
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# ioctl request for cloning a file on btrfs/xfs (Linux)
+FICLONE = 0x40049409
+
+class TransferCancelled(Exception):
+    pass
+
+
+@dataclass
+class TransferJob:
+    """ A single file to be transferred """
+    source: Path
+    target: Path
+    size: int = 0
+    document: Any = None
+    move: bool = False
+    checksum: Optional[str] = None
+    index: int = -1
+
+    @property
+    def destination(self) -> Path:
+        return self.target.parent
+
+@dataclass
+class TransferResult:
+    job: TransferJob
+    error: Optional[BaseException] = None
+    cancelled: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.cancelled
+
+@dataclass
+class TransferStats:
+    """ Progress and throughput for a batch or a single destination """
+    total_files: int = 0
+    total_bytes: int = 0
+    files: int = 0
+    bytes: int = 0
+    failed: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished if self.finished is not None else time.monotonic()
+        return max(end - self.started, 1e-9)
+
+    @property
+    def files_per_sec(self) -> float:
+        return self.files / self.elapsed
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.bytes / self.elapsed / 1e6
+
+    @property
+    def progress(self) -> float:
+        """ Fraction of the batch that is done, by bytes when sizes are known """
+        if self.total_bytes:
+            return self.bytes / self.total_bytes
+        return (self.files + self.failed) / self.total_files if self.total_files else 1.0
+
+    def __str__(self) -> str:
+        return (f'{self.files}/{self.total_files} files, '
+                f'{self.files_per_sec:.1f} files/s, {self.mb_per_sec:.1f} MB/s')
+
+
+def is_rename(job: TransferJob) -> bool:
+    """ Check if the job can be done with a rename on the same filesystem """
+    try:
+        return job.move and os.stat(job.source).st_dev == os.stat(job.destination).st_dev
+    except OSError:
+        return False
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    """ Share the data blocks between the files when the filesystem supports it """
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError:
+        return False
+
+def _copy_range(src_fd: int, dst_fd: int, size: int, cancel: threading.Event) -> bool:
+    """ Copy in the kernel with copy_file_range, falling back to sendfile. Returns
+        False if neither is supported for these files.
+    """
+    for name in ('copy_file_range', 'sendfile'):
+        func = getattr(os, name, None)
+        if func is None:
+            continue
+
+        offset = 0
+        try:
+            while offset < size:
+                if cancel.is_set():
+                    raise TransferCancelled()
+                if name == 'copy_file_range':
+                    n = func(src_fd, dst_fd, min(CHUNK_SIZE, size - offset), offset, offset)
+                else:
+                    n = func(dst_fd, src_fd, offset, min(CHUNK_SIZE, size - offset))
+                if n == 0:
+                    break
+                offset += n
+            return True
+        except OSError as e:
+            if offset or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF):
+                raise
+    return False
+
+def fast_copy(source: Path, target: Path, cancel: threading.Event) -> None:
+    """ Copy file data using the fastest path available: reflink, copy_file_range,
+        sendfile and finally a plain chunked read/write.
+    """
+    with open(source, 'rb') as fsrc, open(target, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+
+        if _reflink(fsrc.fileno(), fdst.fileno()):
+            return
+
+        if size and _copy_range(fsrc.fileno(), fdst.fileno(), size, cancel):
+            return
+
+        while chunk := fsrc.read(CHUNK_SIZE):
+            if cancel.is_set():
+                raise TransferCancelled()
+            fdst.write(chunk)
+
+def copy_file(job: TransferJob, cancel: threading.Event) -> None:
+    """ Copy file and metadata to the target """
+    try:
+        fast_copy(job.source, job.target, cancel)
+    except BaseException:
+        _remove(job.target)
+        raise
+    shutil.copystat(job.source, job.target)
+
+def move_file(job: TransferJob, cancel: threading.Event) -> None:
+    """ Move file to the target. A rename is used on the same filesystem, otherwise
+        the file is copied to a temporary name, verified, renamed into place and
+        only then removed from the source.
+    """
+    if job.target.exists():
+        raise FileExistsError(errno.EEXIST, 'Target already exists', str(job.target))
+
+    if is_rename(job):
+        try:
+            os.rename(job.source, job.target)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+    partial = job.target.with_name(f'.{job.target.name}.part')
+    try:
+        fast_copy(job.source, partial, cancel)
+        shutil.copystat(job.source, partial)
+        verify_copy(job.source, partial, job.checksum)
+        os.replace(partial, job.target)
+    except BaseException:
+        _remove(partial)
+        raise
+
+    os.remove(job.source)
+
+def verify_copy(source: Path, target: Path, checksum: Optional[str] = None) -> None:
+    """ Make sure the copy is complete and on disk before the source is removed """
+    with open(target, 'rb+') as f:
+        os.fsync(f.fileno())
+
+    src_size, dst_size = os.stat(source).st_size, os.stat(target).st_size
+    if src_size != dst_size:
+        raise OSError(errno.EIO, f'Copy is {dst_size} bytes, expected {src_size}', str(target))
+
+    if checksum is not None and file_checksum(target) != checksum:
+        raise OSError(errno.EIO, 'Copy does not match the source checksum', str(target))
+
+def transfer_file(job: TransferJob, cancel: threading.Event) -> None:
+    if job.move:
+        move_file(job, cancel)
+    else:
+        copy_file(job, cancel)
+
+def _remove(path: Path) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class CopyScheduler:
+    """ Run transfers on a bounded worker pool without blocking the caller.
+
+        At most `max_workers` files are transferred at once, and at most
+        `destination_limits[folder]` (or `default_limit`) into the same destination
+        folder. Finished transfers are put on `results` as TransferResult objects so
+        the GUI thread can pick them up.
+
+        With a `journal` the batch is checksummed and written ahead to the journal
+        before any file is touched, and every finished transfer is confirmed in it.
+    """
+    def __init__(self, max_workers: int = 4, destination_limits: Optional[Dict[Path, int]] = None, **kwargs):
+        self.max_workers = max_workers
+        self.destination_limits = destination_limits if destination_limits is not None else {}
+        self.default_limit = kwargs.get('default_limit', 2)
+        self.transfer = kwargs.get('transfer', transfer_file)
+        self.journal = kwargs.get('journal', None)
+
+        self.results: 'queue.Queue[TransferResult]' = queue.Queue()
+        self.stats = TransferStats()
+        self.destination_stats: Dict[Path, TransferStats] = {}
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._waiting: Dict[Path, Deque[TransferJob]] = {}
+        self._active: Dict[Path, int] = {}
+        self._running = 0
+        self._planning = 0
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    @property
+    def is_running(self) -> bool:
+        with self._lock:
+            return self._running > 0 or self._planning > 0 or any(self._waiting.values())
+
+    def start(self, jobs: Iterable[TransferJob], header: Optional[Dict[str, Any]] = None) -> None:
+        """ Queue the jobs and start transferring in the background. The header is
+            stored with the batch in the journal.
+        """
+        jobs = list(jobs)
+        for i, job in enumerate(jobs):
+            job.index = i
+
+        self._prepare(jobs)
+
+        if self.journal is None:
+            self._dispatch()
+            return
+
+        # Checksum the sources on the pool, the last one to finish writes the plan
+        with self._lock:
+            self._planning = len(jobs)
+        for job in jobs:
+            self._executor.submit(self._plan, jobs, job, header)
+
+    def resume(self, jobs: Iterable[TransferJob]) -> None:
+        """ Continue a batch that is already planned in the journal """
+        self._prepare(list(jobs))
+        self._dispatch()
+
+    def _prepare(self, jobs: List[TransferJob]) -> None:
+        if self.is_running:
+            raise RuntimeError('A batch is already running')
+
+        self._cancel.clear()
+        self.stats = TransferStats(total_files=len(jobs), total_bytes=sum(j.size for j in jobs))
+        self.destination_stats = {}
+        self._waiting = {}
+        self._active = {}
+
+        for job in jobs:
+            self._waiting.setdefault(job.destination, deque()).append(job)
+            dst_stats = self.destination_stats.setdefault(job.destination, TransferStats())
+            dst_stats.total_files += 1
+            dst_stats.total_bytes += job.size
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='transfer')
+
+    def _plan(self, jobs: List[TransferJob], job: TransferJob, header: Optional[Dict[str, Any]]) -> None:
+        try:
+            if not self._cancel.is_set() and not is_rename(job):
+                job.checksum = file_checksum(job.source)
+        except OSError as e:
+            logger.warning(f'Could not checksum {job.source}: {e}')
+
+        with self._lock:
+            self._planning -= 1
+            if self._planning:
+                return
+
+        if not self._cancel.is_set():
+            try:
+                self.journal.begin(jobs, header)
+            except OSError as e:
+                logger.error(f'Could not write transfer journal: {e}')
+                self._cancel.set()
+
+        if self._cancel.is_set():
+            self.cancel()
+        else:
+            self._dispatch()
+
+    def cancel(self) -> None:
+        """ Stop starting new transfers. Transfers that are not started are reported as cancelled """
+        self._cancel.set()
+
+        # Results are queued under the lock, so is_running never turns False before they can be read
+        with self._lock:
+            for jobs in self._waiting.values():
+                for job in jobs:
+                    self.results.put(TransferResult(job, cancelled=True))
+            self._waiting = {}
+
+        self._finish_if_done()
+
+    def shutdown(self) -> None:
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def limit(self, destination: Path) -> int:
+        return self.destination_limits.get(destination, self.default_limit)
+
+    def _dispatch(self) -> None:
+        """ Submit waiting jobs while there are free workers and destination slots """
+        with self._lock:
+            for destination, jobs in self._waiting.items():
+                while jobs and self._running < self.max_workers and self._active.get(destination, 0) < self.limit(destination):
+                    job = jobs.popleft()
+                    self._running += 1
+                    self._active[destination] = self._active.get(destination, 0) + 1
+                    self._executor.submit(self._run, job)
+
+    def _run(self, job: TransferJob) -> None:
+        result = TransferResult(job)
+
+        if self._cancel.is_set():
+            result.cancelled = True
+        else:
+            try:
+                self.transfer(job, self._cancel)
+            except TransferCancelled:
+                result.cancelled = True
+            except Exception as e:
+                logger.warning(f'Transfer failed {job.source} -> {job.target}: {e}')
+                result.error = e
+
+        if result.ok and self.journal is not None:
+            self.journal.confirm(job)
+
+        with self._lock:
+            self._running -= 1
+            self._active[job.destination] -= 1
+            if not self._active[job.destination] and not self._waiting.get(job.destination):
+                self.destination_stats[job.destination].finished = time.monotonic()
+
+            for stats in (self.stats, self.destination_stats[job.destination]):
+                if result.ok:
+                    stats.files += 1
+                    stats.bytes += job.size
+                elif result.error is not None:
+                    stats.failed += 1
+
+            self.results.put(result)
+
+        self._dispatch()
+        self._finish_if_done()
+
+    def _finish_if_done(self) -> None:
+        if not self.is_running and self.stats.finished is None:
+            if self.journal is not None:
+                self.journal.flush()
+            self.stats.finished = time.monotonic()
+            for destination, stats in self.destination_stats.items():
+                if stats.finished is None:
+                    stats.finished = self.stats.finished
+                logger.info(f'{destination} (limit {self.limit(destination)}): {stats}')